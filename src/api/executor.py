@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from fastapi import HTTPException
+from functools import partial
+from src.config.config import Config
+from src.core import metrics
+import asyncio
+import threading
+
+config = Config()
+
+
+class InferenceExecutor:
+    """Runs the blocking inference pipeline out of the event loop
+
+    The work is sent to a thread pool (or a process pool) with a bounded number of
+    pending jobs. When all the workers are busy and the queue is full the request
+    is rejected with a 503 instead of piling up, and every job has a timeout.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(InferenceExecutor, cls).__new__(cls)
+                    instance.kind = config.EXECUTOR_KIND
+                    instance.max_workers = config.EXECUTOR_WORKERS
+                    instance.max_queue = config.EXECUTOR_MAX_QUEUE
+                    instance.timeout = config.EXECUTOR_TIMEOUT
+                    if instance.kind == "process":
+                        instance._pool = ProcessPoolExecutor(max_workers=instance.max_workers)
+                    elif instance.kind == "thread":
+                        instance._pool = ThreadPoolExecutor(max_workers=instance.max_workers,
+                                                            thread_name_prefix="inference")
+                    else:
+                        raise ValueError(f"Executor kind not supported: {instance.kind}")
+                    instance._stats_lock = threading.Lock()
+                    instance._pending = 0
+                    instance._stats = {
+                        "submitted": 0,
+                        "completed": 0,
+                        "failed": 0,
+                        "rejected": 0,
+                        "timeouts": 0,
+                        "peak_queue_depth": 0,
+                    }
+                    cls._instance = instance
+        return cls._instance
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    def _queue_depth(self) -> int:
+        return max(0, self._pending - self.max_workers)
+
+    def _on_done(self, future: Future) -> None:
+        with self._stats_lock:
+            self._pending -= 1
+            metrics.EXECUTOR_PENDING.dec()
+            if future.cancelled() or future.exception() is not None:
+                self._stats["failed"] += 1
+            else:
+                self._stats["completed"] += 1
+
+    async def run(self, fn: callable, *args, **kwargs):
+        """Run a blocking function in the pool and wait for its result
+
+        Args:
+            fn (callable): blocking function. With a process pool it must be a
+        module level function and its arguments must be picklable
+
+        Raises:
+            HTTPException: 503 if the queue is full, 504 if the job takes more
+        than the timeout
+
+        Returns:
+            any: the result of the function
+        """
+        with self._stats_lock:
+            if self._pending >= self.capacity:
+                self._stats["rejected"] += 1
+                raise HTTPException(status_code=503,
+                                    detail="Service busy, try again later",
+                                    headers={"Retry-After": "1"})
+            self._pending += 1
+            metrics.EXECUTOR_PENDING.inc()
+            self._stats["submitted"] += 1
+            self._stats["peak_queue_depth"] = max(self._stats["peak_queue_depth"], self._queue_depth())
+
+        future = self._pool.submit(partial(fn, *args, **kwargs))
+        future.add_done_callback(self._on_done)
+        try:
+            # If the job is still queued when the timeout expires it is cancelled
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self._stats["timeouts"] += 1
+            raise HTTPException(status_code=504, detail="Processing timeout")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "kind": self.kind,
+                "workers": self.max_workers,
+                "capacity": self.capacity,
+                "in_flight": self._pending,
+                "queue_depth": self._queue_depth(),
+                **self._stats,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_inference_executor():
+    return InferenceExecutor()
@@ -1,27 +1,70 @@
-from fastapi import FastAPI
-from src.core.ocr_service import get_ocr_service
-from src.core.card_service import get_card_service
+from src.api.startup import get_startup
+from fastapi import FastAPI, Response
+from contextlib import asynccontextmanager
+from src.core.model_registry import warmup_names
+from src.api.executor import get_inference_executor
+from src.core.batcher import get_batchers_stats
+from src.core.iin_resolver import get_iin_resolver
+from src.core.resolution import get_pixel_stats
+from src.core.result_cache import get_result_cache
+from src.core.model_server import get_model_client, models_stats
+from src.core import metrics
 from src.config.config import Config
 from src.api.v1.routes import router as v1_router
 from src.api.v2.routes import router as v2_router
+import time
 import uvicorn
 
-app = FastAPI()
+config = Config()
+
+startup = get_startup()
+startup.record("imports", time.perf_counter() - startup.started_at)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup.phase("executor"):
+        executor = get_inference_executor()
+    # The models of WARMUP_MODELS load in background, the port opens now and
+    # /api/health/ready answers 503 until they are loaded. With a model server
+    # the models are loaded by the server, not by the API
+    startup.start(names=[] if config.MODEL_SERVER_ADDRESS else warmup_names())
+    yield
+    executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Register versioned routes
 app.include_router(v1_router, prefix="/api/v1/service/credit-card", tags=["v1"])
 app.include_router(v2_router, prefix="/api/v2/service/credit-card", tags=["v2"])
 
-config = Config()
-
-# # Create an instance of OCRService
-# ocrService = get_ocr_service()
-# # Create an instance of CardService
-# card_service = get_card_service()
-
 @app.get("/api/health", status_code=200)
+@app.get("/api/health/live", status_code=200)
 def get_service_status() -> dict:
     return {"status": "Ok"}
 
+@app.get("/api/health/ready", status_code=200)
+def get_service_readiness(response: Response) -> dict:
+    if not startup.ready or (config.MODEL_SERVER_ADDRESS and not get_model_client().ping()):
+        response.status_code = 503
+    return startup.stats()
+
+@app.get("/api/stats", status_code=200)
+def get_service_stats() -> dict:
+    return {
+        "startup": startup.stats(),
+        "models": models_stats(),
+        "executor": get_inference_executor().stats(),
+        "batchers": get_batchers_stats(),
+        "iin_cache": get_iin_resolver().stats(),
+        "pixels": get_pixel_stats().stats(),
+        "result_cache": get_result_cache().stats()
+    }
+
+@app.get("/metrics", status_code=200)
+def get_metrics() -> Response:
+    """Prometheus metrics: stage and model latencies, outcomes and in-flight requests"""
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host=config.API_HOST, port=config.API_PORT)
@@ -0,0 +1,160 @@
+"""Preforking server of the API
+
+With API_WORKERS > 1 the master process imports the app and loads the models
+of WARMUP_MODELS (all by default), freezes the objects of the garbage collector
+and forks the workers. The workers share the pages of the weights with the
+master copy-on-write, so the models take their memory once whatever the number
+of workers. Each worker runs its own uvicorn server on the socket bound by the
+master, and the master forks a new worker when one dies.
+
+The forked workers can't use a CUDA context created by the master, so the models
+must run on CPU. On GPU run the models in the model server (MODEL_SERVER_ADDRESS),
+then the master loads nothing and the workers are thin clients.
+
+Usage (from src/api, like the service):
+    API_WORKERS=4 python -m src.api.server
+"""
+from src.config.config import Config
+import gc
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+config = Config()
+
+
+def setup_multiprocess_metrics() -> None:
+    """Each worker writes its Prometheus metrics to PROMETHEUS_MULTIPROC_DIR and
+    /metrics sums them. It must be set before prometheus_client is imported"""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # The files of the workers of a previous run are not valid anymore
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="card-service-metrics-")
+
+
+def preload() -> None:
+    """Load the models in the master, before the workers are forked"""
+    from src.core.model_registry import get_model_registry, warmup_names
+    from src.utils.logger import get_logger
+
+    logger = get_logger(__name__)
+    if config.MODEL_SERVER_ADDRESS:
+        logger.info("The models run in the model server %s, nothing to preload", config.MODEL_SERVER_ADDRESS)
+        return
+    registry = get_model_registry()
+    names = warmup_names() or registry.names()
+    cuda = [name for name in names if registry.device_for(name).startswith("cuda")]
+    if cuda:
+        raise EnvironmentError(f"The models {cuda} are placed on CUDA, the forked workers can't share them. "
+                               "Set DEVICE=cpu or run the models in the model server (MODEL_SERVER_ADDRESS)")
+    start = time.perf_counter()
+    registry.warmup(names)
+    logger.info("Models preloaded in %.1fs, %.0f MB RSS", time.perf_counter() - start,
+                registry.stats()["rss_mb"])
+
+
+def worker_threads(workers: int) -> int:
+    return config.WORKER_THREADS or max(1, (os.cpu_count() or 1) // workers)
+
+
+def run_worker(server_config, sock, threads: int) -> None:
+    """Body of a forked worker, it never returns"""
+    import uvicorn
+    import cv2
+
+    # uvicorn installs its own handlers of the signals
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # The workers share the CPUs instead of each one using all of them
+    cv2.setNumThreads(threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+    uvicorn.Server(config=server_config).run(sockets=[sock])
+    sys.exit(0)
+
+
+def serve(workers: int) -> int:
+    """Load the models, fork the workers and wait for them
+
+    Args:
+        workers (int): number of worker processes
+
+    Returns:
+        int: exit code of the master
+    """
+    setup_multiprocess_metrics()
+    import uvicorn
+    from prometheus_client import multiprocess
+    from src.api.main import app
+    from src.utils.logger import get_logger
+
+    logger = get_logger(__name__)
+    server_config = uvicorn.Config(app, host=config.API_HOST, port=config.API_PORT, lifespan="on")
+    sock = server_config.bind_socket()
+    preload()
+    # The objects loaded until now are never collected, so the garbage collector of
+    # the workers doesn't write their headers and their pages stay shared
+    gc.collect()
+    gc.freeze()
+
+    threads = worker_threads(workers)
+    pids = {}
+    stopping = False
+
+    def fork_worker(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            run_worker(server_config=server_config, sock=sock, threads=threads)
+        pids[pid] = index
+        logger.info("Worker %s started (pid %s, %s threads)", index, pid, threads)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        fork_worker(index)
+
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = pids.pop(pid, None)
+        multiprocess.mark_process_dead(pid)
+        if index is not None and not stopping:
+            logger.warning("Worker %s (pid %s) exited with code %s, starting a new one", index, pid,
+                           os.waitstatus_to_exitcode(status))
+            # A worker that fails at start doesn't make the master fork in a loop
+            time.sleep(1)
+            fork_worker(index)
+    sock.close()
+    return 0
+
+
+def main() -> int:
+    if config.API_WORKERS <= 1:
+        # A single worker serves in this process, like python main.py
+        import uvicorn
+        from src.api.main import app
+        uvicorn.run(app, host=config.API_HOST, port=config.API_PORT)
+        return 0
+    return serve(workers=config.API_WORKERS)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from src.core.model_registry import get_model_registry
+from src.config.config import Config
+from src.utils.logger import get_logger
+from typing import List
+import threading
+import time
+
+config = Config()
+logger = get_logger(__name__)
+
+# main imports this module first, so the startup time includes the other imports
+IMPORT_START = time.perf_counter()
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class Startup:
+    """Startup state of the service
+
+    The API opens its port as soon as the routes are imported, the heavy
+    libraries (torch, easyocr, ultralytics) are only imported when a model is
+    loaded. The models of WARMUP_MODELS are loaded in a background thread and
+    the service is ready when all of them are loaded. The time of each phase
+    of the startup is logged and kept for the readiness endpoint.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(Startup, cls).__new__(cls)
+                    instance.started_at = IMPORT_START
+                    instance.status = STARTING
+                    instance.error = None
+                    instance.phases = {}
+                    instance._thread = None
+                    cls._instance = instance
+        return cls._instance
+
+    def record(self, name: str, elapsed: float) -> None:
+        self.phases[name] = elapsed
+        logger.info("Startup phase %s finished in %.3fs", name, elapsed)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Context manager that records the time of a phase of the startup"""
+        start = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start)
+
+    def start(self, names: List[str]) -> None:
+        """Load the models in a background thread, the service is ready when
+        the thread finishes
+
+        Args:
+            names (List[str]): names of the models to load
+        """
+        if not names:
+            self._set_ready()
+            return
+        self._thread = threading.Thread(target=self._warmup, args=(names,), name="warmup", daemon=True)
+        self._thread.start()
+
+    def _warmup(self, names: List[str]) -> None:
+        registry = get_model_registry()
+        try:
+            with self.phase("warmup"):
+                for name in names:
+                    with self.phase(f"load:{name}"):
+                        registry.get(name)
+        except Exception as e:
+            self.status = FAILED
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error("Startup failed: %s", self.error)
+            return
+        self._set_ready()
+
+    def _set_ready(self) -> None:
+        self.status = READY
+        self.record("ready", time.perf_counter() - self.started_at)
+
+    @property
+    def ready(self) -> bool:
+        return self.status == READY
+
+    def stats(self) -> dict:
+        return {"status": self.status, "error": self.error, "phases": dict(self.phases)}
+
+
+def get_startup():
+    return Startup()
@@ -1,26 +1,35 @@
 from fastapi import APIRouter, File, UploadFile
-from src.utils.file_utils import validate_image, image_to_numpy
-from src.core.credit_card_processor import credit_card_detector, get_zones_coords
-from src.core.ocr_service import get_ocr_service
+from fastapi.concurrency import run_in_threadpool
+from src.utils.file_utils import validate_image
+from src.core.model_server import run_pipeline
 from src.models.model import CreditCardData
+from src.core.result_cache import get_result_cache
+from src.api.executor import get_inference_executor
+from src.core import metrics
+import numpy as np
 
 router = APIRouter()
 
-# Create an instance of OCRService
-ocrService = get_ocr_service()
+def process_card(img_np: np.ndarray) -> CreditCardData:
+    """Blocking v1 pipeline, it runs in the inference executor"""
+    return run_pipeline("v1", img=img_np)
 
 @router.post("/", status_code=200)
 async def credit_card_service(payment_network: str, file: UploadFile = File(...)):
-    image = validate_image(file=file)
-    img_np = image_to_numpy(image=image)
-    credit_card, payment_network = credit_card_detector(img=img_np)
-    response = CreditCardData()
-    if credit_card and payment_network:
-        response.payment_network = payment_network
-        ocrService.set_img(img=credit_card)
-        ocrService.set_zones_coords(zones=get_zones_coords(payment_network))
-        response = ocrService.extract(entity=response)
-        response.obs = "Successful process!"
-    else:
-        response.obs = "Can't detect credit card."
+    with metrics.in_flight("v1"):
+        return await run_credit_card_service(file=file)
+
+async def run_credit_card_service(file: UploadFile) -> CreditCardData:
+    # Reading and decoding the upload is blocking, it runs out of the event loop
+    img_np = await run_in_threadpool(validate_image, file)
+    # A retry of the same scan is answered from the result cache
+    cache = get_result_cache()
+    if cache.enabled:
+        key = await run_in_threadpool(cache.key, img_np, "v1")
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    response = await get_inference_executor().run(process_card, img_np)
+    if cache.enabled:
+        cache.put(key, response)
     return response
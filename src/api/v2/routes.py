@@ -1,42 +1,109 @@
-from fastapi import APIRouter, File, UploadFile
-from src.utils.file_utils import validate_image, image_to_numpy
-from src.core.ocr_service import get_ocr_service
-from src.core.card_service import get_card_service
+from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from src.utils.file_utils import validate_image, decode_image, read_batch_files
+from src.core.model_server import run_pipeline
 from src.config.config import Config
 from src.models.model import CreditCardData
+from src.core.result_cache import get_result_cache
+from src.api.executor import get_inference_executor
+from src.core import metrics
+from src.utils.logger import get_logger
+from typing import List, Tuple
+import numpy as np
+import json
 
 router = APIRouter()
 
 config = Config()
-ocrService = get_ocr_service()
-card_service = get_card_service()
+logger = get_logger(__name__)
+
+def process_card(img_np: np.ndarray) -> CreditCardData:
+    """Blocking v2 pipeline, it runs in the inference executor"""
+    return run_pipeline("v2", img=img_np)
+
+def process_files(items: List[Tuple[str, bytes, str]]) -> List[CreditCardData]:
+    """Decode the files of a batch and run the batched pipeline over the valid images"""
+    cache = get_result_cache()
+    responses = [CreditCardData() for _ in items]
+    valid, imgs, keys = [], [], []
+    for i, (_, data, error) in enumerate(items):
+        # The files over the size limits were not read
+        if error is not None:
+            responses[i].obs = error
+            continue
+        try:
+            img = decode_image(data=data)
+        except ValueError as e:
+            responses[i].obs = str(e)
+            continue
+        # Only the images without a cached result go to the pipeline. The batched pipeline
+        # fills the fields differently than the single one, so its results have their own namespace
+        key = cache.key(img, "v2_batch") if cache.enabled else None
+        cached = cache.get(key) if key is not None else None
+        if cached is not None:
+            responses[i] = cached
+            continue
+        imgs.append(img)
+        valid.append(i)
+        keys.append(key)
+    for i, key, response in zip(valid, keys, run_pipeline("v2_batch", imgs=imgs) if imgs else []):
+        if key is not None:
+            cache.put(key, response)
+        responses[i] = response
+    return responses
 
 @router.post("/", status_code=200)
 async def get_data(file: UploadFile = File(...)):
-    print("Enter to get_data()")
-    print(f"Image from request --- {file}")
-    
-    # Valid that file is an image
-    image = validate_image(file=file)
-    # Convert file to numpy array
-    img_np = image_to_numpy(image=image)
-    # Detect a card in the image
-    card = card_service.get_card_bbox(input_img=img_np)
-    response = CreditCardData()
-    if card is not None:
-        # Detect the card elements
-        card_elements = card_service.get_card_elements(card=card)
-        # Classify the payment network
-        payment_network = card_service.classify_payment_network(
-            element=card_elements['payment_network'],
-            card=card
-        )
-        response.payment_network = payment_network
-        ocrService.set_img(img=card)
-        ocrService.set_images(elements=card_elements)
-        ocrService.set_zones_coords(zones=config.COMMON_CARD_ZONES)
-        response = ocrService.extract(entity=response)
-        response.obs = "Succesfull process!"
-    else:
-        response.obs = "Invalid image"
-    return response
\ No newline at end of file
+    logger.debug("Image from request --- %s", file.filename)
+    with metrics.in_flight("v2"):
+        return await run_get_data(file=file)
+
+async def run_get_data(file: UploadFile) -> CreditCardData:
+    # Valid that file is an image and decode it to a numpy array
+    # Reading and decoding the upload is blocking, it runs out of the event loop
+    img_np = await run_in_threadpool(validate_image, file)
+    # A retry of the same scan is answered from the result cache
+    cache = get_result_cache()
+    if cache.enabled:
+        key = await run_in_threadpool(cache.key, img_np, "v2")
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    # Run the models out of the event loop
+    response = await get_inference_executor().run(process_card, img_np)
+    if cache.enabled:
+        cache.put(key, response)
+    return response
+
+@router.post("/batch", status_code=200)
+async def get_batch_data(files: List[UploadFile] = File(...)):
+    """Process many card images, uploaded as a list of files or zip files.
+    The result of each image is streamed as a JSON line (NDJSON) when its
+    chunk of images is processed"""
+    # Reading and expanding the zip files is blocking, it runs out of the event loop
+    items = await run_in_threadpool(read_batch_files, files)
+    executor = get_inference_executor()
+
+    async def stream_results():
+        # The batch is in flight while its results are streamed
+        with metrics.in_flight("v2_batch"):
+            async for line in stream_chunks():
+                yield line
+
+    async def stream_chunks():
+        for start in range(0, len(items), config.BATCH_CHUNK_SIZE):
+            chunk = items[start:start + config.BATCH_CHUNK_SIZE]
+            try:
+                results = await executor.run(process_files, chunk)
+            except HTTPException as e:
+                # The response is already streaming, so the error goes in each line
+                results = [CreditCardData(obs=e.detail) for _ in chunk]
+            except Exception:
+                # A failure of the models only loses its chunk, the next chunks are processed
+                logger.exception("Batch chunk of %s images failed", len(chunk))
+                results = [CreditCardData(obs="Error processing the image") for _ in chunk]
+            for (name, _, _), result in zip(chunk, results):
+                yield json.dumps({"filename": name, **result.to_dict()}) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
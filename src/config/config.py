@@ -1,6 +1,18 @@
+from dotenv import load_dotenv
+import os
+
+# Load the project .env once so every setting below can be overridden from it
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../.env'))
+
 class Config: 
     BASE_PATTERNS_DIR = "../../data/patterns"
 
+    # Directory of the precomputed SIFT index of the pattern images
+    SIFT_INDEX_DIR = os.getenv("SIFT_INDEX_DIR", "../../data/index/sift")
+    # Logo matching mode: "exact" (brute force) or "flann" (approximate, index of the logos
+    # built once). flann counts the matches per target descriptor, its counts are not the exact ones
+    SIFT_MATCHER_MODE = os.getenv("SIFT_MATCHER_MODE", "exact")
+
     PATTERNS_DICT = {
         "visa": '../../data/patterns/visa1.jpg',
         "visa_aux": '../../data/patterns/visa2.jpg',
@@ -17,31 +29,31 @@ class Config:
     }
     
     VISA_CREDIT_CARD_ZONES = {
-        "type": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
+        "payment_network": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
         "card_number": [(0.0, 0.50858934169279), (1.0826771653543308, 0.7053291536050157)],
-        "name": [(0.0, 0.7950470219435737), (0.7381889763779528, 0.9504388714733543)],
-        "expiration_date": [(0.3952755905511811, 0.7053291536050157), (0.6889763779527559, 0.8175862068965517)]
+        "cardholder": [(0.0, 0.7950470219435737), (0.7381889763779528, 0.9504388714733543)],
+        "expiry_date": [(0.3952755905511811, 0.7053291536050157), (0.6889763779527559, 0.8175862068965517)]
     }
 
     MASTER_CREDIT_CARD_ZONES = {
-        "type": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
+        "payment_network": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
         "card_number": [(0.0, 0.50858934169279), (1.0826771653543308, 0.6453291536050157)],
-        "name": [(0.0, 0.750470219435737), (0.7381889763779528, 0.9004388714733543)],
-        "expiration_date": [(0.3952755905511811, 0.6653291536050157), (0.6089763779527559, 0.775862068965517)]
+        "cardholder": [(0.0, 0.750470219435737), (0.7381889763779528, 0.9004388714733543)],
+        "expiry_date": [(0.3952755905511811, 0.6653291536050157), (0.6089763779527559, 0.775862068965517)]
     }
 
     AMERICAN_CREDIT_CARD_ZONES = {
-        "type": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
+        "payment_network": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
         "card_number": [(0.0, 0.52858934169279), (1.0826771653543308, 0.6753291536050157)],
-        "name": [(0.0, 0.8550470219435737), (0.7381889763779528, 0.9904388714733543)],
-        "expiration_date": [(0.3952755905511811, 0.7053291536050157), (0.6089763779527559, 0.8075862068965517)]
+        "cardholder": [(0.0, 0.8550470219435737), (0.7381889763779528, 0.9904388714733543)],
+        "expiry_date": [(0.3952755905511811, 0.7053291536050157), (0.6089763779527559, 0.8075862068965517)]
     }
 
     CABAL_CREDIT_CARD_ZONES = {
-        "type": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
+        "payment_network": [(0.6889763779527559, 0.6269592476489029), (1.0826771653543308, 1.4106583072100314)],
         "card_number": [(0.0, 0.42858934169279), (1.0826771653543308, 0.5853291536050157)],
-        "name": [(0.0, 0.7050470219435737), (0.7681889763779528, 0.8504388714733543)],
-        "expiration_date": [(0.3952755905511811, 0.5853291536050157), (0.6689763779527559, 0.7175862068965517)]
+        "cardholder": [(0.0, 0.7050470219435737), (0.7681889763779528, 0.8504388714733543)],
+        "expiry_date": [(0.3952755905511811, 0.5853291536050157), (0.6689763779527559, 0.7175862068965517)]
     }
 
     COMMON_CARD_NUMBER_ZONE = [(0.0, 0.50858934169279), (1.0826771653543308, 0.7053291536050157)]
@@ -51,4 +63,141 @@ class Config:
     VISA_CONSTANT = "VISA"
     MASTERCARD_CONSTANT = "MASTERCARD"
     AMERCIAN_EXPRESS_CONSTANT = "AMERICAN EXPRESS"
-    CABAL_CONSTANT = "CABAL"
\ No newline at end of file
+    CABAL_CONSTANT = "CABAL"
+    DISCOVER_CONSTANT = "DISCOVER"
+    JCB_CONSTANT = "JCB"
+    DINERS_CLUB_CONSTANT = "DINERS CLUB"
+    MAESTRO_CONSTANT = "MAESTRO"
+    UNIONPAY_CONSTANT = "UNIONPAY"
+    
+    # Model registry settings
+    # Device used by every model managed by the registry: "auto", "cpu", "cuda", "cuda:1"...
+    DEVICE = os.getenv("DEVICE", "auto")
+    # Device of each model, over DEVICE: "yolo_card_detector=cuda:0,easyocr_reader=cuda:1,..."
+    MODEL_DEVICES = dict(item.split("=", 1) for item in os.getenv("MODEL_DEVICES", "").replace(" ", "").split(",")
+                         if "=" in item)
+    # Comma separated model names to load at API startup ("all" loads every registered model)
+    WARMUP_MODELS = os.getenv("WARMUP_MODELS", "")
+
+    # Number of easyocr readers that can run at the same time in the process
+    OCR_READER_POOL_SIZE = int(os.getenv("OCR_READER_POOL_SIZE", "1"))
+    # "recognize" reads all the detected elements in one call without text detection,
+    # "readtext" runs text detection + recognition on each crop. The zones of the card
+    # (v1 and the fallback of v2) are always read with text detection
+    OCR_MODE = os.getenv("OCR_MODE", "recognize")
+
+    # Inference executor of the API
+    # Pool where the pipeline runs: "thread" or "process"
+    EXECUTOR_KIND = os.getenv("EXECUTOR_KIND", "thread")
+    EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "1"))
+    # Requests waiting for a free worker before answering 503
+    EXECUTOR_MAX_QUEUE = int(os.getenv("EXECUTOR_MAX_QUEUE", "16"))
+    # Seconds a request can take before answering 504
+    EXECUTOR_TIMEOUT = float(os.getenv("EXECUTOR_TIMEOUT", "60"))
+
+    # Micro-batching of the YOLO card detector, a max size of 1 disables it
+    CARD_BATCH_MAX_SIZE = int(os.getenv("CARD_BATCH_MAX_SIZE", "1"))
+    # Milliseconds that the first image of a batch waits for more images
+    CARD_BATCH_MAX_WAIT_MS = float(os.getenv("CARD_BATCH_MAX_WAIT_MS", "5"))
+
+    # Images processed together by each step of the batch endpoint
+    BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "16"))
+    # Limits of a batch request, the zip files count by their uncompressed members (413 over them)
+    MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "256"))
+    MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(512 * 2 ** 20)))
+
+    # IIN lookup cache of the BINLIST service
+    IIN_CACHE_DB = os.getenv("IIN_CACHE_DB", "../../data/cache/iin_cache.sqlite3")
+    IIN_CACHE_SIZE = int(os.getenv("IIN_CACHE_SIZE", "10000"))
+    # Seconds that a known IIN and an IIN unknown to BINLIST stay in the cache
+    IIN_CACHE_TTL = float(os.getenv("IIN_CACHE_TTL", str(30 * 24 * 3600)))
+    IIN_NEGATIVE_TTL = float(os.getenv("IIN_NEGATIVE_TTL", str(24 * 3600)))
+    BINLIST_CONNECT_TIMEOUT = float(os.getenv("BINLIST_CONNECT_TIMEOUT", "1"))
+    BINLIST_READ_TIMEOUT = float(os.getenv("BINLIST_READ_TIMEOUT", "2"))
+    BINLIST_POOL_SIZE = int(os.getenv("BINLIST_POOL_SIZE", "4"))
+    # Seconds without calling BINLIST after a failed request
+    BINLIST_COOLDOWN = float(os.getenv("BINLIST_COOLDOWN", "60"))
+
+    # Table of IIN ranges used to identify the payment network offline
+    IIN_RANGES_PATH = os.getenv("IIN_RANGES_PATH", "../../data/iin/iin_ranges.csv")
+    # Ask BINLIST for the numbers that are not inside any range of the table
+    IIN_REMOTE_LOOKUP = os.getenv("IIN_REMOTE_LOOKUP", "true").lower() == "true"
+
+    # v2 pipeline: "sequential" skips the classifier when the IIN of the card number
+    # defines the payment network, "concurrent" runs the OCR and the classifier at the same time
+    PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sequential")
+
+    # Inference backend of the YOLO models: "torch", "onnx" or "openvino".
+    # The models are exported next to their weights the first time they are loaded
+    YOLO_BACKEND = os.getenv("YOLO_BACKEND", "torch")
+
+    # Precision of the YOLO models: "fp32", "fp16" or "int8". fp16 runs the torch
+    # backend in half precision on GPU, or exports half precision onnx/openvino models.
+    # int8 needs the onnx (dynamic quantization) or openvino (static quantization) backend
+    YOLO_PRECISION = os.getenv("YOLO_PRECISION", "fp32")
+    # Ultralytics dataset yaml with the images that calibrate the openvino int8 models,
+    # empty uses the Ultralytics sample dataset of the task
+    YOLO_INT8_DATA = {
+        "detect": os.getenv("YOLO_INT8_DATA_DETECT", ""),
+        "classify": os.getenv("YOLO_INT8_DATA_CLASSIFY", ""),
+    }
+    # Dynamic int8 quantization of the EasyOCR recognizer (only applies on CPU)
+    OCR_QUANTIZE = os.getenv("OCR_QUANTIZE", "true").lower() == "true"
+
+    # Filters of the YOLO detectors, applied inside the model call: min confidence of
+    # a box, IoU threshold of the NMS and NMS across classes (a region has one element)
+    DETECTION_CONF = float(os.getenv("DETECTION_CONF", "0.25"))
+    DETECTION_IOU = float(os.getenv("DETECTION_IOU", "0.5"))
+    DETECTION_AGNOSTIC_NMS = os.getenv("DETECTION_AGNOSTIC_NMS", "true").lower() == "true"
+
+    # Limits of the uploaded images, checked before decoding them (413 over the limits)
+    MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(20 * 2 ** 20)))
+    MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+    # Downsample the images while they are decoded (by 2, 4 or 8) when their longest
+    # side is at least twice this value, 0 decodes them at full resolution
+    DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", "0"))
+
+    # The detectors run on a copy downscaled to this longest side (0 keeps the
+    # resolution), their boxes are mapped back and the crops are cut from the original
+    DETECT_MAX_SIDE = int(os.getenv("DETECT_MAX_SIDE", "1280"))
+    ELEMENTS_MAX_SIDE = int(os.getenv("ELEMENTS_MAX_SIDE", "1280"))
+    # Height of the crops read by the OCR recognizer in "recognize" mode (0 keeps it)
+    OCR_MAX_HEIGHT = int(os.getenv("OCR_MAX_HEIGHT", "64"))
+
+    # Cache of the results by image content, for the retries of the same scan.
+    # RESULT_CACHE_SIZE=0 disables it. The results expire after RESULT_CACHE_TTL seconds
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+    RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+    # Optional disk store of the cache, encrypted with the Fernet key RESULT_CACHE_KEY
+    # (it needs the cryptography package). Empty keeps the results only in memory
+    RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")
+    RESULT_CACHE_KEY = os.getenv("RESULT_CACHE_KEY", "")
+    RESULT_CACHE_DISK_SIZE = int(os.getenv("RESULT_CACHE_DISK_SIZE", "10000"))
+
+    # Spans of the pipeline stages (OpenTelemetry API). The exporter is configured by
+    # the OpenTelemetry SDK of the deployment, the stage histograms of /metrics are always on
+    OTEL_TRACING = os.getenv("OTEL_TRACING", "false").lower() == "true"
+    OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "card-service")
+
+    # Logs of the service: level, format (json or text) and fraction of the DEBUG
+    # records of the hot paths that are written. The card numbers are always masked
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+    # Unix socket of the model server (python -m src.core.model_server). When it is set the
+    # API and the demo send the images to the server instead of loading their own models
+    MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+    # Shared secret of the connections to the model server, required to start it: the
+    # server unpickles what the clients send
+    MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "")
+    # Port of the Prometheus metrics of the model server, 0 disables them
+    MODEL_SERVER_METRICS_PORT = int(os.getenv("MODEL_SERVER_METRICS_PORT", "0"))
+
+    # API server (python -m src.api.server). With API_WORKERS > 1 the models are loaded
+    # once and the workers are forked from that process, sharing the weights copy-on-write
+    API_HOST = os.getenv("API_HOST", "0.0.0.0")
+    API_PORT = int(os.getenv("API_PORT", "8000"))
+    API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+    # Threads of torch and OpenCV in each worker, 0 splits the CPUs between the workers
+    WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))
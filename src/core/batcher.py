@@ -0,0 +1,119 @@
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+import queue
+import threading
+import time
+
+
+class MicroBatcher:
+    """Groups the items submitted by concurrent requests into batches
+
+    A background thread takes the first waiting item and keeps collecting items
+    until the batch has max_batch_size items or max_wait_ms milliseconds have
+    passed. Then it runs the batch function once with the whole batch and sends
+    each output back to the request that submitted the input.
+
+    The batch function receives a list of inputs and must return a list of
+    outputs in the same order.
+    """
+
+    _batchers = {}
+    _batchers_lock = threading.Lock()
+
+    def __init__(self, name: str, fn: Callable[[list], list], max_batch_size: int = 8,
+                 max_wait_ms: float = 5.0):
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._fn = fn
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._histogram = Counter()
+        self._items = 0
+        self._batches = 0
+        with MicroBatcher._batchers_lock:
+            MicroBatcher._batchers[name] = self
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop,
+                                                name=f"batcher-{self.name}",
+                                                daemon=True)
+                self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Add an item to the next batch
+
+        Args:
+            item (any): input of the batch function
+
+        Returns:
+            Future: future with the output of the batch function for the item
+        """
+        if self._thread is None:
+            self._start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self) -> List[tuple]:
+        batch = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            # Skip the requests that were cancelled while they were waiting
+            if item[1].set_running_or_notify_cancel():
+                batch.append(item)
+            if len(batch) >= self.max_batch_size:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                outputs = list(self._fn([item for item, _ in batch]))
+                # zip would leave the futures without an output waiting forever
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"Batcher {self.name} got {len(outputs)} outputs for {len(batch)} items")
+                for (_, future), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._lock:
+                self._histogram[len(batch)] += 1
+                self._items += len(batch)
+                self._batches += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else None,
+                "batch_size_histogram": dict(sorted(self._histogram.items())),
+            }
+
+
+def get_batchers_stats() -> Dict[str, dict]:
+    with MicroBatcher._batchers_lock:
+        batchers = list(MicroBatcher._batchers.values())
+    return {batcher.name: batcher.stats() for batcher in batchers}
@@ -0,0 +1,233 @@
+from src.core.pipeline import Pipeline, Stage
+from src.core.pipeline_context import PipelineContext
+from src.core.card_service import get_card_service
+from src.core.ocr_service import get_ocr_service
+from src.core.iin_ranges import get_iin_range_table, valid_pan
+from src.core import metrics
+from src.config.config import Config
+from src.models.model import CreditCardData, DetectionResult
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import numpy as np
+import threading
+import time
+
+config = Config()
+
+def detect_card(context: PipelineContext) -> None:
+    card_service = get_card_service()
+    context.detections["card"] = card_service.detect_card(input_img=context.image)
+    card = card_service.crop_card(input_img=context.image, detection=context.detections["card"])
+    if card is not None:
+        context.set_card(card)
+
+def detect_elements(context: PipelineContext) -> None:
+    card_service = get_card_service()
+    context.detections["elements"] = card_service.detect_elements(card=context.card)
+    context.elements = card_service.crop_elements(card=context.card, detection=context.detections["elements"])
+
+def ocr_fields(context: PipelineContext) -> None:
+    context.result = get_ocr_service().extract(card=context.card,
+                                               elements=context.elements,
+                                               zones=config.COMMON_CARD_ZONES,
+                                               entity=context.result,
+                                               context=context)
+    context.iin_network = lookup_iin(card_number=context.result.card_number)
+
+def lookup_iin(card_number: str) -> str:
+    """Payment network of the IIN of a card number, None if it is not in the IIN ranges"""
+    # The IIN of the card number is enough to know the payment network, but only when
+    # the OCR read a whole valid number. A partial or misread number leaves the network
+    # to the classifier
+    if not valid_pan(card_number):
+        return None
+    with metrics.stage("iin_lookup"):
+        return get_iin_range_table().lookup(card_number=card_number)
+
+def classify_network(context: PipelineContext) -> None:
+    context.payment_network = get_card_service().classify_payment_network(
+        element=context.elements['payment_network'],
+        card=context.card
+    )
+
+def build_card_pipeline(mode: str = "sequential") -> Pipeline:
+    """Build the v2 pipeline: detect card -> detect elements -> OCR fields and
+    classify payment network
+
+    Args:
+        mode (str, optional): "sequential" runs the OCR before the classifier and
+    skips the classifier when the IIN of the card number determines the payment
+    network. "concurrent" runs the OCR and the classifier at the same time.
+    Default value is "sequential"
+
+    Returns:
+        Pipeline: the card pipeline
+    """
+    stages = [
+        Stage(name="detect_card", fn=detect_card, stop_if=lambda context: context.card is None),
+        Stage(name="detect_elements", fn=detect_elements),
+    ]
+    ocr = Stage(name="ocr_fields", fn=ocr_fields)
+    classify = Stage(name="classify_network", fn=classify_network,
+                     skip_if=lambda context: context.iin_network is not None)
+    if mode == "concurrent":
+        stages.append([ocr, classify])
+    elif mode == "sequential":
+        stages.extend([ocr, classify])
+    else:
+        raise ValueError(f"Pipeline mode not supported: {mode}")
+    return Pipeline(stages=stages, concurrency=pipeline_concurrency())
+
+def pipeline_concurrency() -> int:
+    """Requests that can run a pipeline at the same time in this process: the workers
+    of the inference executor, of every API worker when they send the images to the
+    model server"""
+    return max(1, config.EXECUTOR_WORKERS) * max(1, config.API_WORKERS)
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_card_pipeline() -> Pipeline:
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = build_card_pipeline(mode=config.PIPELINE_MODE)
+    return _pipeline
+
+def network_outcome(classifier: str = None, iin: str = None) -> str:
+    """Outcome of the metrics by the source of the payment network of a card"""
+    if classifier:
+        return metrics.NETWORK_CLASSIFIER
+    if iin:
+        return metrics.NETWORK_IIN
+    return metrics.NETWORK_UNKNOWN
+
+def get_confidences(card: DetectionResult, elements: DetectionResult = None) -> dict:
+    """Confidence of the detected card and of each of its elements"""
+    confidences = {"card": float(card.conf[0])}
+    if elements is not None:
+        confidences.update(get_card_service().element_confidences(detection=elements))
+    return confidences
+
+def process_image(img: np.ndarray) -> CreditCardData:
+    """Detect a card in the image and extract its data with the v2 pipeline
+
+    Args:
+        img (np.ndarray): input image in numpy array format
+
+    Returns:
+        CreditCardData: the data of the card, with the time of each stage in timings
+    """
+    context = PipelineContext(image=img)
+    context.result = CreditCardData()
+    get_card_pipeline().run(context=context)
+
+    response = context.result
+    if context.card is None:
+        response.obs = "Invalid image"
+        metrics.count_outcome(pipeline="v2", outcome=metrics.INVALID_IMAGE)
+    else:
+        metrics.count_outcome(pipeline="v2", outcome=network_outcome(classifier=context.payment_network,
+                                                                     iin=context.iin_network))
+        # The classifier has priority, when it was skipped the IIN defines the network
+        response.payment_network = context.payment_network or context.iin_network
+        response.obs = "Succesfull process!"
+        response.confidences = get_confidences(card=context.detections["card"],
+                                               elements=context.detections.get("elements"))
+    response.timings = context.timings
+    return response
+
+# Threads for the classifier of the batched pipeline, so its forward pass overlaps
+# with the OCR that runs in the caller thread. One for each request that can run
+# at the same time, the batches of different requests don't wait for each other
+_classifier_pool = ThreadPoolExecutor(max_workers=pipeline_concurrency(), thread_name_prefix="classifier")
+
+def process_images(imgs: List[np.ndarray]) -> List[CreditCardData]:
+    """Batched v2 pipeline for many images, each stage runs batched over all
+    the images. The payment network follows the same rules as process_image:
+    the classifier has priority and the IIN of the card number is the fallback.
+    In "sequential" mode only the cards whose IIN is not in the IIN ranges are
+    classified, in "concurrent" mode the classification of the payment networks
+    runs at the same time that the OCR of the fields
+
+    Args:
+        imgs (List[np.ndarray]): input images in numpy array format
+
+    Returns:
+        List[CreditCardData]: the data of the card of each image. The timings are
+    the times of the stages of the whole batch
+    """
+    card_service = get_card_service()
+    ocr_service = get_ocr_service()
+    timings = {}
+    start = time.perf_counter()
+
+    def finish(responses: List[CreditCardData]) -> List[CreditCardData]:
+        timings["total"] = time.perf_counter() - start
+        for response in responses:
+            response.timings = dict(timings)
+        return responses
+
+    stage_start = time.perf_counter()
+    detections = card_service.detect_cards(input_imgs=imgs)
+    cards = [card_service.crop_card(input_img=img, detection=detection)
+             for img, detection in zip(imgs, detections)]
+    timings["detect_card"] = time.perf_counter() - stage_start
+    responses = [CreditCardData(obs="Invalid image") for _ in imgs]
+    valid = [i for i, card in enumerate(cards) if card is not None]
+    if len(valid) < len(imgs):
+        metrics.count_outcome(pipeline="v2_batch", outcome=metrics.INVALID_IMAGE, count=len(imgs) - len(valid))
+    valid_cards = [cards[i] for i in valid]
+    if not valid_cards:
+        return finish(responses)
+
+    stage_start = time.perf_counter()
+    elements_detections = card_service.detect_cards_elements(cards=valid_cards)
+    cards_elements = [card_service.crop_elements(card=card, detection=detection)
+                      for card, detection in zip(valid_cards, elements_detections)]
+    timings["detect_elements"] = time.perf_counter() - stage_start
+
+    def classify(indexes: List[int]) -> List[str]:
+        stage_start = time.perf_counter()
+        networks = card_service.classify_payment_networks(
+            elements=[cards_elements[i]['payment_network'] for i in indexes],
+            cards=[valid_cards[i] for i in indexes]
+        ) if indexes else []
+        timings["classify_network"] = time.perf_counter() - stage_start
+        return networks
+
+    def extract() -> List[CreditCardData]:
+        stage_start = time.perf_counter()
+        # The crops of every card are read in a single OCR call
+        extracted = ocr_service.extract_batch(cards=valid_cards,
+                                              elements=cards_elements,
+                                              zones=config.COMMON_CARD_ZONES)
+        iin_networks[:] = [lookup_iin(card_number=response.card_number) for response in extracted]
+        timings["ocr_fields"] = time.perf_counter() - stage_start
+        return extracted
+
+    payment_networks = [None] * len(valid_cards)
+    iin_networks = [None] * len(valid_cards)
+    if config.PIPELINE_MODE == "concurrent":
+        future = _classifier_pool.submit(classify, list(range(len(valid_cards))))
+        extracted = extract()
+        payment_networks = future.result()
+    else:
+        extracted = extract()
+        # The cards whose IIN defines the payment network skip the classifier
+        unresolved = [j for j, iin_network in enumerate(iin_networks) if iin_network is None]
+        for j, payment_network in zip(unresolved, classify(unresolved)):
+            payment_networks[j] = payment_network
+
+    # Merge the outputs of both branches
+    for i, response, payment_network, iin_network, elements_detection in zip(valid, extracted, payment_networks,
+                                                                              iin_networks, elements_detections):
+        metrics.count_outcome(pipeline="v2_batch", outcome=network_outcome(classifier=payment_network,
+                                                                           iin=iin_network))
+        # The classifier has priority, when it was skipped the IIN defines the network
+        response.payment_network = payment_network or iin_network
+        response.obs = "Succesfull process!"
+        response.confidences = get_confidences(card=detections[i], elements=elements_detection)
+        responses[i] = response
+    return finish(responses)
@@ -1,15 +1,49 @@
-from ultralytics import YOLO
 from dotenv import load_dotenv
 from src.utils.file_utils import crop_image, show_image, extract_zone
 from src.config.config import Config
+from src.core.batcher import MicroBatcher
+from src.core.inference_backend import load_yolo
+from src.core.model_registry import get_model_registry
+from src.core import metrics
+from src.core.resolution import downscale
+from src.models.model import DetectionResult
+from src.utils.logger import get_logger
 import numpy as np
 import os
-import torchvision as tv
 
+config = Config()
+logger = get_logger(__name__)
+
+CARD_DETECTOR_MODEL = "yolo_card_detector"
+ELEMENTS_DETECTOR_MODEL = "yolo_elements_detector"
+CLASSIFIER_MODEL = "yolo_payment_network_classifier"
+MODEL_TASKS = {
+    CARD_DETECTOR_MODEL: "detect",
+    ELEMENTS_DETECTOR_MODEL: "detect",
+    CLASSIFIER_MODEL: "classify",
+}
+
+def load_card_model(name: str):
+    """Loader of a YOLO model of the card service for the model registry, the model
+    runs on the device that the registry gives to it"""
+    return lambda device: load_yolo(weights=get_card_service().weights[name], task=MODEL_TASKS[name],
+                                    device=device)
+
+registry = get_model_registry()
+for model_name in MODEL_TASKS:
+    registry.register(model_name, load_card_model(model_name))
 
 class CardService:
     
     _instance = None
+
+    # Name of each class of the elements detector
+    ELEMENT_CLASSES = {
+        0: "card_number",
+        1: "expiry_date",
+        2: "cardholder",
+        3: "payment_network",
+    }
     
     def __new__(cls):
         if cls._instance is None:
@@ -22,7 +56,7 @@ class CardService:
 
             load_dotenv(env_path)
             
-            print("Environment variables loaded from ", env_path)
+            logger.info("Environment variables loaded from %s", env_path)
             card_detector_model = os.getenv('YOLO_CARD_DETECTOR')
             elements_detector_model = os.getenv('YOLO_CARD_ELEMENT_DETECTOR')
             classifier_model = os.getenv('YOLO_PAYMENT_NETWORK_CLASSIFIER')
@@ -31,50 +65,110 @@ class CardService:
             if not all([card_detector_model, elements_detector_model, classifier_model]):
                 raise EnvironmentError("Failed in load environment variables")
             
-            print(f"YOLO_CARD_DETECTOR: {card_detector_model}")
-            print(f"YOLO_CARD_ELEMENT_DETECTOR: {elements_detector_model}")
-            print(f"YOLO_PAYMENT_NETWORK_CLASSIFIER: {classifier_model}")
+            logger.info("YOLO_CARD_DETECTOR: %s", card_detector_model)
+            logger.info("YOLO_CARD_ELEMENT_DETECTOR: %s", elements_detector_model)
+            logger.info("YOLO_PAYMENT_NETWORK_CLASSIFIER: %s", classifier_model)
             
             cls._instance = super(CardService, cls).__new__(cls)
-            cls.card_detector = YOLO(model=card_detector_model)
-            cls.elements_detector = YOLO(model=elements_detector_model)
-            cls.classifier = YOLO(model=classifier_model)
+            logger.info("YOLO_BACKEND: %s - YOLO_PRECISION: %s", config.YOLO_BACKEND, config.YOLO_PRECISION)
+            # The models are loaded by the model registry the first time they are used
+            cls.weights = {
+                CARD_DETECTOR_MODEL: card_detector_model,
+                ELEMENTS_DETECTOR_MODEL: elements_detector_model,
+                CLASSIFIER_MODEL: classifier_model,
+            }
+            # Micro-batching of the card detector across concurrent requests
+            cls.card_batcher = None
+            if config.CARD_BATCH_MAX_SIZE > 1:
+                cls.card_batcher = MicroBatcher(name="card_detector",
+                                                fn=cls._instance._detect_cards,
+                                                max_batch_size=config.CARD_BATCH_MAX_SIZE,
+                                                max_wait_ms=config.CARD_BATCH_MAX_WAIT_MS)
                     
         return cls._instance
     
-    def _inference(self, detector: any, img: np.ndarray, iou_threshold: float=0.5) -> tuple:
+    @property
+    def card_detector(self):
+        return registry.get(CARD_DETECTOR_MODEL)
+
+    @property
+    def elements_detector(self):
+        return registry.get(ELEMENTS_DETECTOR_MODEL)
+
+    @property
+    def classifier(self):
+        return registry.get(CLASSIFIER_MODEL)
+
+    @property
+    def _detector_args(self) -> dict:
+        # Confidence filter and NMS run inside the model call, the boxes come out final
+        return {"conf": config.DETECTION_CONF,
+                "iou": config.DETECTION_IOU,
+                "agnostic_nms": config.DETECTION_AGNOSTIC_NMS,
+                "verbose": False}
+
+    def _inference(self, model: str, img: np.ndarray, max_side: int = 0, stage: str = None) -> DetectionResult:
         """
         Run the inference process on the provided image using the specified detector.
 
         Args:
-            detector (any): The detection model to be used for inference.
+            model (str): The name in the model registry of the detector to be used for inference.
             img (np.ndarray): The input image on which to run inference.
-            iou_threshold (float, optional): Intersection over Union (IoU) threshold for 
-                                             Non-Max Suppression (NMS). Default is 0.5.
+            max_side (int, optional): The image is downscaled to this longest side before
+                                      the inference, 0 keeps its resolution. Default is 0.
+            stage (str, optional): Name of the stage in the pixel stats.
         
         Returns:
-            tuple: A tuple containing two lists:
-                - xyxy (list): List of bounding boxes' coordinates after applying NMS.
-                - clss (list): List of class labels corresponding to the selected bounding boxes.
-            
+            DetectionResult: The boxes, classes and confidences detected in the image,
+                             filtered by DETECTION_CONF and DETECTION_IOU. The boxes are
+                             in coordinates of the input image.
+        """
+        return self._inference_batch(model=model, imgs=[img], max_side=max_side, stage=stage)[0]
+
+    def _inference_batch(self, model: str, imgs: list, max_side: int = 0, stage: str = None) -> list:
         """
-        result = detector(source=img)
+        Run the inference process on a list of images with a single forward pass.
 
-        xyxy = result[0].boxes.xyxy.cpu()
-        clss = result[0].boxes.cls.cpu()
-        confs = result[0].boxes.conf.cpu()
+        Args:
+            model (str): The name in the model registry of the detector to be used for inference.
+            imgs (list): The input images on which to run inference.
+            max_side (int, optional): Longest side of the images in the inference, like _inference.
+            stage (str, optional): Name of the stage in the pixel stats.
+        
+        Returns:
+            list: A DetectionResult for each input image, like _inference.
+        """
+        # The detectors work on a downscaled copy, the boxes are mapped back to full resolution
+        scaled = [downscale(img=img, max_side=max_side, stage=stage) for img in imgs]
+        detector = registry.get(model)
+        with registry.timed(model):
+            results = detector(source=[small for small, _ in scaled], **self._detector_args)
+        return [DetectionResult.from_boxes(boxes=result.boxes, scale=scale)
+                for result, (_, scale) in zip(results, scaled)]
 
-        # Aplicar NMS (Non-Max Suppression)
-        filtered_id_boxes = tv.ops.nms(boxes=xyxy, scores=confs, iou_threshold=iou_threshold)
+    def _detect_cards(self, imgs: list) -> list:
+        # Batch function of the card detector micro-batcher
+        return self._inference_batch(model=CARD_DETECTOR_MODEL, imgs=imgs,
+                                     max_side=config.DETECT_MAX_SIDE, stage="card_detector")
 
-        # Seleccionar y convertir los cuadros de delimitación filtrados a una lista
-        xyxy = xyxy[filtered_id_boxes].tolist()
-        # Seleccionar y convertir las etiquetas de clase filtradas a una lista
-        clss = clss[filtered_id_boxes].tolist()
+    def detect_card(self, input_img: np.ndarray) -> DetectionResult:
+        """
+        Detects the credit or debit cards of the input image. When CARD_BATCH_MAX_SIZE
+        is greater than 1 the image is detected in a batch together with the images
+        of other concurrent requests.
 
-        return xyxy, clss
+        Args:
+            input_img (np.ndarray): The input image in which to detect the card.
+
+        Returns:
+            DetectionResult: The boxes of the cards detected in the image.
+        """
+        with metrics.stage("card_detect"):
+            # Concurrent requests share a forward pass when batching is enabled
+            if self.card_batcher is not None:
+                return self.card_batcher(input_img)
+            return self._detect_cards(imgs=[input_img])[0]
 
-    
     def get_card_bbox(self, input_img: np.ndarray, show: bool=False):
         """
         Detects the bounding box of a credit or debit card in the input image.
@@ -93,15 +187,53 @@ class CardService:
             np.ndarray or None: The cropped image of the credit/debit card if one is found.
                                 Returns None if no card or multiple cards are detected.
         """
+        return self.crop_card(input_img=input_img, detection=self.detect_card(input_img=input_img), show=show)
+
+    def detect_cards(self, input_imgs: list) -> list:
+        """
+        Detects the credit or debit cards of many images with a single forward pass.
+
+        Args:
+            input_imgs (list): The input images in which to detect the cards.
+
+        Returns:
+            list: A DetectionResult for each image.
+        """
+        with metrics.stage("card_detect", images=len(input_imgs)):
+            return self._detect_cards(imgs=input_imgs)
+
+    def get_card_bboxes(self, input_imgs: list) -> list:
+        """
+        Detects the credit or debit card of many images with a single forward pass.
+
+        Args:
+            input_imgs (list): The input images in which to detect the cards.
+
+        Returns:
+            list: The cropped card of each image, None for the images where no card
+                  or multiple cards are detected.
+        """
+        return [self.crop_card(input_img=img, detection=detection)
+                for img, detection in zip(input_imgs, self.detect_cards(input_imgs=input_imgs))]
+
+    @staticmethod
+    def crop_card(input_img: np.ndarray, detection: DetectionResult, show: bool=False):
+        """
+        Crops the card detected in the input image.
+
+        Args:
+            input_img (np.ndarray): The input image where the card was detected.
+            detection (DetectionResult): The output of the card detector for the image.
+            show (bool, optional): Flag to display the input and cropped images. Default is False.
+
+        Returns:
+            np.ndarray or None: The cropped card, None if no card or multiple cards are detected.
+        """
         # Validate if the model detected only one credit/debit card, else the image is not valid
-        xyxy, clss = self._inference(detector=self.card_detector,
-                                      img=input_img)
-            
-        if len(xyxy) == 1:
-            # Cast to int the coordinates
-            xyxy = [int(xy) for xy in xyxy[0]]
-            print(f"Credit card box -> {xyxy} - Class -> {clss[0]}")
-            credit_card = crop_image(img=input_img, bbox=xyxy)
+        if len(detection) == 1:
+            box = detection.xyxy[0]
+            logger.debug("Credit card box -> %s - Class -> %s - Conf -> %.2f", box, detection.cls[0], detection.conf[0])
+            credit_card = crop_image(img=input_img, bbox=box)
             
             if show:
                 show_image(img=input_img, label="Input Image")
@@ -110,6 +242,37 @@ class CardService:
             return credit_card
         
         return None
+
+    def detect_elements(self, card: np.ndarray) -> DetectionResult:
+        """
+        Detects the elements (card number, expiry date, cardholder and payment network)
+        of a credit/debit card image.
+
+        Args:
+            card (np.ndarray): The input image of the credit/debit card.
+
+        Returns:
+            DetectionResult: The boxes of the elements, the class ids are the keys of ELEMENT_CLASSES.
+        """
+        with metrics.stage("element_detect"):
+            return self._inference(model=ELEMENTS_DETECTOR_MODEL, img=card,
+                                   max_side=config.ELEMENTS_MAX_SIDE, stage="elements_detector")
+
+    def detect_cards_elements(self, cards: list) -> list:
+        """
+        Detects the elements of many credit/debit card images with a single forward pass.
+
+        Args:
+            cards (list): The input images of the credit/debit cards.
+
+        Returns:
+            list: A DetectionResult for each card.
+        """
+        if not cards:
+            return []
+        with metrics.stage("element_detect", images=len(cards)):
+            return self._inference_batch(model=ELEMENTS_DETECTOR_MODEL, imgs=cards,
+                                         max_side=config.ELEMENTS_MAX_SIDE, stage="elements_detector")
     
     def get_card_elements(self, card: np.ndarray, show: bool=False) -> dict:
         """
@@ -136,16 +299,24 @@ class CardService:
                   - 'payment_network': The image of the payment network logo.
                   Each key will have a value of None if the corresponding element is not detected.
         """
-        xyxy, clss = self._inference(detector=self.elements_detector,
-                                     img=card)
-        
         # Cut the card elements from credit card image and set dictionary with values
-        elements_dict = self._set_elements(card=card,
-                                           boxes=xyxy,
-                                           clss=clss)
+        elements_dict = self.crop_elements(card=card, detection=self.detect_elements(card=card))
         if show:
-            [show_image(img=value, label=key) for key, value in elements_dict.items()]
+            [show_image(img=value, label=key) for key, value in elements_dict.items() if value is not None]
         return elements_dict
+
+    def get_cards_elements(self, cards: list) -> list:
+        """
+        Extracts the elements of many credit/debit card images with a single forward pass.
+
+        Args:
+            cards (list): The input images of the credit/debit cards.
+
+        Returns:
+            list: A dictionary for each card with the same keys of get_card_elements.
+        """
+        return [self.crop_elements(card=card, detection=detection)
+                for card, detection in zip(cards, self.detect_cards_elements(cards=cards))]
     
     def classify_payment_network(self, element: np.ndarray, card: np.ndarray) -> str:
         """
@@ -169,13 +340,37 @@ class CardService:
                  - config.VISA_CONSTANT
                  Returns None if the classification is not successful.
         """
-        config = Config()
         if element is None:
             element = extract_zone(img=card, zone=config.COMMON_CARD_ZONES['payment_network'])
-        result = self.classifier(source=element)
-        top1 = result[0].probs.top1
-        top1_conf = result[0].probs.top1conf
-        
+        classifier = self.classifier
+        with metrics.stage("classify"), registry.timed(CLASSIFIER_MODEL):
+            result = classifier(source=element)
+        return self._to_payment_network(top1=result[0].probs.top1)
+
+    def classify_payment_networks(self, elements: list, cards: list) -> list:
+        """
+        Classifies the payment network of many credit/debit cards with a single forward pass.
+
+        Args:
+            elements (list): The image of the payment network logo of each card, or None
+                             to crop it from the card with a predefined bounding box.
+            cards (list): The images of the credit/debit cards.
+
+        Returns:
+            list: The classified payment network of each card, like classify_payment_network.
+        """
+        if not cards:
+            return []
+        logos = [element if element is not None
+                 else extract_zone(img=card, zone=config.COMMON_CARD_ZONES['payment_network'])
+                 for element, card in zip(elements, cards)]
+        classifier = self.classifier
+        with metrics.stage("classify", images=len(logos)), registry.timed(CLASSIFIER_MODEL):
+            results = classifier(source=logos)
+        return [self._to_payment_network(top1=result.probs.top1) for result in results]
+
+    @staticmethod
+    def _to_payment_network(top1: int) -> str:
         if top1 == 0:
             return config.AMERCIAN_EXPRESS_CONSTANT
         elif top1 == 1:
@@ -189,31 +384,29 @@ class CardService:
         
     
     @staticmethod
-    def _set_elements(card: np.ndarray, boxes: list, clss: list) -> dict:
-        dict = {}
-        card_number = None
-        cardholder = None
-        expiry_date = None
-        payment_network = None
-        for box, cls in zip(boxes, clss):
-            box = [int(b) for b in box]
-            print(f"Box {box} - cls {cls}")
-            if cls == 0.0:
-                card_number = crop_image(img=card, bbox=box)
-            elif cls == 1.0:
-                expiry_date = crop_image(img=card, bbox=box)
-            elif cls == 2.0:
-                cardholder = crop_image(img=card, bbox=box)
-            elif cls == 3.0:
-                payment_network = crop_image(img=card, bbox=box)
-            else:
-                pass
-        
-        dict['card_number'] = card_number if card_number is not None else None
-        dict['expiry_date'] = expiry_date if expiry_date is not None else None
-        dict['cardholder'] = cardholder if cardholder is not None else None
-        dict['payment_network'] = payment_network if payment_network is not None else None
-        return dict
+    def crop_elements(card: np.ndarray, detection: DetectionResult) -> dict:
+        """
+        Crops the elements detected in a card. When an element is detected more than
+        once the most confident box is used.
+
+        Args:
+            card (np.ndarray): The image of the credit/debit card.
+            detection (DetectionResult): The output of the elements detector for the card.
+
+        Returns:
+            dict: The image of each element of ELEMENT_CLASSES, None if it was not detected.
+        """
+        elements = {}
+        for class_id, name in CardService.ELEMENT_CLASSES.items():
+            box = detection.box(class_id)
+            elements[name] = crop_image(img=card, bbox=box) if box is not None else None
+        return elements
+
+    @staticmethod
+    def element_confidences(detection: DetectionResult) -> dict:
+        """Confidence of each element of ELEMENT_CLASSES, None if it was not detected"""
+        return {name: detection.confidence(class_id)
+                for class_id, name in CardService.ELEMENT_CLASSES.items()}
 
     
 def get_card_service():
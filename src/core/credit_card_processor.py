@@ -1,21 +1,67 @@
 from src.core.gd_inference import predict
 from src.core.object_detector import SIFTObjectDetector
+from src.core.reference_index import SIFTReferenceIndex
+from src.core.logo_matcher import LogoMatcher
+from src.core.model_registry import get_model_registry
+from src.core.iin_resolver import get_iin_resolver
+from src.core.iin_ranges import get_iin_range_table
+from src.core.pipeline_context import PipelineContext
+from src.core import metrics
 from src.core.ocr_service import get_ocr_service
 from src.utils.file_utils import crop_image, show_image, extract_zone
 from src.config.config import Config
 from src.models.model import CreditCardData
+from src.utils.logger import get_logger
 from dotenv import load_dotenv
+from typing import TYPE_CHECKING
 import numpy as np
 import cv2 
-import supervision as sv
-import traceback
 import os
-import requests 
 
 load_dotenv("../../.env")
 config = Config()
+logger = get_logger(__name__)
 
-def credit_card_detector(img: np.ndarray, show: bool=False):
+if TYPE_CHECKING:
+    import supervision as sv
+
+SIFT_MATCHER_NAME = "sift_logo_matcher"
+
+def load_sift_logo_matcher(device: str) -> LogoMatcher:
+    # SIFT runs on CPU with OpenCV, it is registered with a fixed device
+    index = SIFTReferenceIndex.load_or_build(patterns=config.PATTERNS_DICT,
+                                             index_dir=config.SIFT_INDEX_DIR)
+    return LogoMatcher(index=index, mode=config.SIFT_MATCHER_MODE)
+
+registry = get_model_registry()
+registry.register(SIFT_MATCHER_NAME, load_sift_logo_matcher, device="cpu")
+
+def process_credit_card(img: np.ndarray) -> CreditCardData:
+    """v1 pipeline: GroundingDINO card detection, payment network by IIN or SIFT
+    and OCR of the zones of the payment network
+
+    Args:
+        img (np.ndarray): input image (BGR)
+
+    Returns:
+        CreditCardData: the data extracted from the card
+    """
+    # Each region of the card is read only once along the request
+    context = PipelineContext()
+    credit_card, payment_network = credit_card_detector(img=img, context=context)
+    response = CreditCardData()
+    if credit_card is not None and payment_network:
+        response.payment_network = payment_network
+        response = get_ocr_service().extract(card=credit_card,
+                                             zones=get_zones_coords(payment_network),
+                                             entity=response,
+                                             context=context)
+        response.obs = "Successful process!"
+    else:
+        response.obs = "Can't detect credit card."
+    return response
+
+def credit_card_detector(img: np.ndarray, show: bool=False, context: PipelineContext=None):
     """Detect and analyse a credit card on an image
     
     This function make the follows steps:
@@ -27,15 +73,18 @@ def credit_card_detector(img: np.ndarray, show: bool=False):
         img (np.ndarray): input image in numpy array format
         show (bool, optional): if is true, show the input image and
     cropped image. Default value is false
+        context (PipelineContext, optional): artifacts of the request. The detected
+    card is set on it, so the following stages reuse its zones and OCR results
     
     Returns;
         Tuple[np.ndarray, str]: a tuple that include:
             - np.ndarray: cropped image or None if not detected any credit card
             - str: name of the Payment Network, None if can not define
     """
-    detections = predict(img=img)    
+    with metrics.stage("card_detect_v1"):
+        detections = predict(img=img)
     bbox = get_credit_card_bbox(detections=detections)
-    print(f"Bounding Box of Credit Card --- {bbox}")
+    logger.debug("Bounding Box of Credit Card --- %s", bbox)
     if bbox is not None:
         credit_card = crop_image(img=img,
                                  bbox=bbox)
@@ -44,12 +93,16 @@ def credit_card_detector(img: np.ndarray, show: bool=False):
             show_image(img, "Input Image")
             show_image(credit_card, "Credit Card")
             
-        payment_network = identify_payment_network(credit_card=credit_card)
-        print(f"Payment Network --- {payment_network}")
+        if context is not None:
+            context.set_card(credit_card)
+        payment_network = identify_payment_network(credit_card=credit_card,
+                                                   context=context)
+        logger.debug("Payment Network --- %s", payment_network)
         return credit_card, payment_network
+    metrics.count_outcome(pipeline="v1", outcome=metrics.INVALID_IMAGE)
     return None, None
     
-def get_credit_card_bbox(detections: sv.Detections) -> list:
+def get_credit_card_bbox(detections: "sv.Detections") -> list:
     """This method returns a bounding box of credit card from 
     detections object if inside that object there are 1 detection else
     return None
@@ -64,12 +117,11 @@ def get_credit_card_bbox(detections: sv.Detections) -> list:
     
     if len(xyxy) == 1:
         xyxy = [int(coord) for coord in xyxy[0]]
-        print(f"TYPE XYXY ---- {type(xyxy)}")
     else:
         xyxy = None
     return xyxy    
     
-def identify_payment_network(credit_card: np.ndarray) -> str:
+def identify_payment_network(credit_card: np.ndarray, context: PipelineContext=None) -> str:
     """This method identifies the Payment Network of a credit card
     from its image.
     
@@ -84,26 +136,33 @@ def identify_payment_network(credit_card: np.ndarray) -> str:
     Args:
         credit_card (np.ndarray): image of a credit card in numpy
     array format. It is expected to be a color image (BGR or RGB)
+        context (PipelineContext, optional): artifacts of the request
 
     Returns:
         str: name of the Payment Network identified (e.g, "VISA", "MASTERCARD")
     """
     # TODO: develop a identify by IIN logic
-    payment_network = identify_by_IIN(credit_card=credit_card)
+    payment_network = identify_by_IIN(credit_card=credit_card, context=context)
     if payment_network is not None:
+        metrics.count_outcome(pipeline="v1", outcome=metrics.NETWORK_IIN)
         return payment_network
-    return identify_by_SIFT(credit_card=credit_card)
+    payment_network = identify_by_SIFT(credit_card=credit_card)
+    metrics.count_outcome(pipeline="v1", outcome=metrics.NETWORK_SIFT if payment_network else metrics.NETWORK_UNKNOWN)
+    return payment_network
 
-def identify_by_IIN(credit_card: np.ndarray) -> str:
+def identify_by_IIN(credit_card: np.ndarray, context: PipelineContext=None) -> str:
     """Identify the Payment Network of a credit card using it IIN
     
     This function make the follows steps
     1. Extract the credit card number by OCR technique
-    2. Try to identified the payment network using a extern service (BINLIST)
-    3. If failed the extern service, try to identify the payment network locally 
+    2. Try to identify the payment network locally with the IIN range table
+    3. If the number is not inside any known range and IIN_REMOTE_LOOKUP is
+    enabled, try to identified the payment network using a extern service (BINLIST)
 
     Args:
         credit_card (np.ndarray): credit card image in a numpy array format
+        context (PipelineContext, optional): artifacts of the request. The OCR of
+    the card number zone is stored on it, so the extraction does not read it again
 
     Returns:
         str: the name of the payment network. Return None if can not identify it
@@ -117,16 +176,16 @@ def identify_by_IIN(credit_card: np.ndarray) -> str:
     ocrService = get_ocr_service()
     zone = config.COMMON_CARD_NUMBER_ZONE
     card_number = ocrService.get_credit_card_number(img=credit_card,
-                                                    zone=zone)
+                                                    zone=zone,
+                                                    context=context)
     
     if len(card_number) > 6:
-        # First try to identify the payment network by BINLIST
-        payment_network = get_payment_network(card_number=card_number)
+        # First try to identify the payment network by a locally way
+        payment_network = get_payment_network_local(card_number=card_number)
         
-        if payment_network is None:
-            # Try to identify the payment network by a locally way
-            payment_network = get_payment_network_local(card_number=card_number)
-            return payment_network
+        if payment_network is None and config.IIN_REMOTE_LOOKUP:
+            # Only the numbers out of the known ranges go to BINLIST
+            payment_network = get_payment_network(card_number=card_number)
         
         return payment_network
     return None
@@ -137,7 +196,8 @@ def identify_by_SIFT(credit_card: np.ndarray) -> str:
     This function extract the zone or ROI where it is common to find the logo
     of Payment Network. Then apply the SIFT algorithm to detect and compare
     characteristics with references images and determine the Payment Network
-    based on best match
+    based on best match. The descriptors of the reference images come from a
+    precomputed index that is loaded once per process
 
     Args:
         credit_card (np.ndarray): image of a credit card in numpy
@@ -154,10 +214,11 @@ def identify_by_SIFT(credit_card: np.ndarray) -> str:
     detector = SIFTObjectDetector(match_threshold=20, lowe_ratio=0.7)
     # Set a target image to detector
     detector.set_target_image(image=zone)
-    # Load reference images
-    detector.load_reference_images(config.PATTERNS_DICT)
+    # Use the logo matcher shared by the whole process
+    detector.set_matcher(matcher=registry.get(SIFT_MATCHER_NAME))
     # Make the matching
-    result = detector.detect()
+    with metrics.stage("sift"), registry.timed(SIFT_MATCHER_NAME):
+        result = detector.detect()
     
     if result != None:
         if result.startswith("visa"):
@@ -184,7 +245,8 @@ def get_zones_coords(payment_network: str) -> dict:
         return config.CABAL_CREDIT_CARD_ZONES
 
 def get_payment_network(card_number: str) -> str:
-    """Define the payment network by BINLIST service
+    """Define the payment network by BINLIST service. The answers are cached
+    by IIN in memory and on disk, so most lookups never call the service
 
     Args:
         card_number (str): full credit card number
@@ -202,48 +264,21 @@ def get_payment_network(card_number: str) -> str:
         raise ValueError("The API url is not set up in your environments variables")
     
     # BINLIST only accept the first 6 digits
-    iin = card_number[:6]
-    
-    endpoint = f"{api_url}/{iin}"
-    try:
-        response = requests.get(endpoint)
-        response.raise_for_status()
-        data = response.json()
-        
-        payment_network = data.get("scheme")
-        if payment_network.startswith("visa"):
-            return config.VISA_CONSTANT
-        elif payment_network.startswith("mastercard"):
-            return config.MASTERCARD_CONSTANT
-        elif payment_network.startswith("american"):
-            return config.AMERCIAN_EXPRESS_CONSTANT
-        else:
-            return config.CABAL_CONSTANT
-    except requests.RequestException as e:
-        print(f"Error in the request to API: {e}")
-        traceback.print_exc()
-        return None
+    with metrics.stage("bin_remote_lookup"):
+        return get_iin_resolver().resolve(api_url=api_url, card_number=card_number)
 
 def get_payment_network_local(card_number: str) -> str:
     """ Determines the payment network based on the first digits of the
     credit card number.
     
-    The rules are:
+    The digits are searched in the IIN range table (IIN_RANGES_PATH), for example:
         - Visa: Start with 4
-        - Mastercard: Start with 51, 52, 53, 54, o 55
+        - Mastercard: Start with 51 to 55 or 2221 to 2720
         - American Express: Start with 34 o 37
-        - Cabal: Start with 6
+        - Cabal: Start with 589657, 600691, 603522, 627170 or 60420100 to 60440099
 
     Returns:
         str | None: the name of the payment network or None if can not identify it
     """
-    if card_number.startswith("4"):
-        return config.VISA_CONSTANT
-    if card_number.startswith(("51", "52", "53", "54", "55")):
-        return config.MASTERCARD_CONSTANT
-    if card_number.startswith(("34", "37")):
-        return config.AMERCIAN_EXPRESS_CONSTANT
-    if card_number.startswith("6"):
-        return config.CABAL_CONSTANT
-    return None
-   
+    with metrics.stage("iin_lookup"):
+        return get_iin_range_table().lookup(card_number=card_number)
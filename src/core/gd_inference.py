@@ -1,17 +1,45 @@
-from groundingdino.util.inference import Model
+from src.core.model_registry import get_model_registry
+from src.core.resolution import downscale
+from src.config.config import Config
+from src.utils.logger import get_logger
+from typing import TYPE_CHECKING
 import numpy as np
-import torch
+
+config = Config()
+logger = get_logger(__name__)
+
+if TYPE_CHECKING:
+    from groundingdino.util.inference import Model
 
 MODEL_CONFIG_PATH = "../config/GroundingDINO_SwinT_OGC.py"
 WEIGHTS_PATH = "../../weights/groundingdino_swint_ogc.pth"
-device = "cuda" if torch.cuda.is_available() else "cpu"
+MODEL_NAME = "grounding_dino"
+
+def load_model(device: str) -> "Model":
+    """Builds the GroundingDINO model from its config and checkpoint
+
+    Args:
+        device (str): device where the model is placed (cpu/cuda)
+
+    Returns:
+        Model: GroundingDINO model ready to make inference
+    """
+    # groundingdino imports torch, it is imported when the model is loaded
+    from groundingdino.util.inference import Model
+    return Model(model_config_path=MODEL_CONFIG_PATH,
+                 model_checkpoint_path=WEIGHTS_PATH,
+                 device=device)
+
+registry = get_model_registry()
+registry.register(MODEL_NAME, load_model)
 
 def predict(img: np.ndarray):
     """Performs credit card detection in an image using the GroundingDINO
     model.
     
-    This function loads the pre-trained GroundingDINO model and uses it to
-    detect credit cards in the image provided. Use a text prompot to guide
+    This function takes the pre-trained GroundingDINO model from the model
+    registry (it is loaded only once per process) and uses it to detect
+    credit cards in the image provided. Use a text prompot to guide
     detection.
 
     Args:
@@ -31,19 +59,23 @@ def predict(img: np.ndarray):
     Notes:
         - Uses a pre-trained GroundingDINO model specific in MODEL_CONFIG
         - The detections make with thresholds pre-defined
-        - The execution runtime (CPU/CUDA) is defined on automatic way
+        - The execution runtime (CPU/CUDA) is defined once by the model registry
+        - The image is downscaled to DETECT_MAX_SIDE, the boxes are in coords of
+    the input image
         - The prompt used is "credit card"
     """
-    model = Model(model_config_path=MODEL_CONFIG_PATH,
-              model_checkpoint_path=WEIGHTS_PATH,
-              device=device)
+    model = registry.get(MODEL_NAME)
     BOX_THRESHOLD = 0.35
     TEXT_THRESHOLD = 0.25
     TEXT_PROMPT = ["credit card"]
 
-    detections = model.predict_with_classes(image=img,
-                                        classes=TEXT_PROMPT,
-                                        box_threshold=BOX_THRESHOLD,
-                                        text_threshold=TEXT_THRESHOLD)
-    print(f"GroundingDino detections --- {detections}")
+    # Detect on a downscaled copy and map the boxes back to the input image
+    small, scale = downscale(img=img, max_side=config.DETECT_MAX_SIDE, stage=MODEL_NAME)
+    with registry.timed(MODEL_NAME):
+        detections = model.predict_with_classes(image=small,
+                                                classes=TEXT_PROMPT,
+                                                box_threshold=BOX_THRESHOLD,
+                                                text_threshold=TEXT_THRESHOLD)
+    detections.xyxy = detections.xyxy * scale
+    logger.debug("GroundingDino detections --- %s - confidence %s", detections.xyxy, detections.confidence)
     return detections
\ No newline at end of file
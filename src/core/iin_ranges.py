@@ -0,0 +1,155 @@
+from src.config.config import Config
+from typing import Iterable, List
+import numpy as np
+import csv
+import re
+import threading
+
+config = Config()
+
+
+class IINRangeTable:
+    """Offline classifier of card numbers by IIN ranges
+
+    The ranges are loaded from a CSV file with the columns start, end and network,
+    where start and end are card number prefixes of any length. Every prefix is
+    normalized to a key of KEY_DIGITS digits and the ranges are flattened to a
+    sorted table of disjoint intervals (the narrowest range wins where ranges
+    overlap), so a lookup is a binary search over the interval starts.
+    """
+
+    KEY_DIGITS = 8
+    # Digits of the shortest IIN, a card number must start with them to be looked up
+    MIN_DIGITS = 6
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, networks: np.ndarray):
+        self.starts = starts
+        self.ends = ends
+        self.networks = networks
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def _to_range(cls, start: str, end: str) -> tuple:
+        start, end = start.strip(), end.strip()
+        if not (start.isdigit() and end.isdigit()) or len(start) > cls.KEY_DIGITS or len(end) > cls.KEY_DIGITS:
+            raise ValueError(f"IIN range not valid: {start}-{end}")
+        return int(start.ljust(cls.KEY_DIGITS, "0")), int(end.ljust(cls.KEY_DIGITS, "9"))
+
+    @classmethod
+    def from_ranges(cls, ranges: List[tuple]) -> "IINRangeTable":
+        """Build the table from a list of (start, end, network) prefix ranges
+
+        Args:
+            ranges (List[tuple]): ranges with the prefixes as strings
+
+        Returns:
+            IINRangeTable: the table with disjoint and sorted intervals
+        """
+        keyed = [(*cls._to_range(start, end), network) for start, end, network in ranges]
+        # Elementary intervals between every range boundary
+        bounds = sorted({start for start, _, _ in keyed} | {end + 1 for _, end, _ in keyed})
+        starts, ends, networks = [], [], []
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            covering = [(end - start, network) for start, end, network in keyed if start <= low and high - 1 <= end]
+            if not covering:
+                continue
+            network = min(covering, key=lambda item: item[0])[1]
+            if networks and networks[-1] == network and ends[-1] + 1 == low:
+                ends[-1] = high - 1
+            else:
+                starts.append(low)
+                ends.append(high - 1)
+                networks.append(network)
+        return cls(starts=np.array(starts, dtype=np.int64),
+                   ends=np.array(ends, dtype=np.int64),
+                   networks=np.array(networks, dtype=object))
+
+    @classmethod
+    def load(cls, path: str) -> "IINRangeTable":
+        with open(path, newline="") as f:
+            rows = csv.DictReader(line for line in f if not line.startswith("#"))
+            return cls.from_ranges([(row["start"], row["end"], row["network"]) for row in rows])
+
+    @classmethod
+    def to_key(cls, card_number: str) -> int:
+        """Key of the first digits of a card number, -1 (no range) when the number
+        doesn't start with MIN_DIGITS digits. The spaces and dashes of the groups are
+        ignored, but the digits of any other text read by the OCR are not an IIN
+
+        Examples:
+            >>> IINRangeTable.to_key("4111 1111 1111 1111")
+            41111111
+            >>> IINRangeTable.to_key("4"), IINRangeTable.to_key("VALID THRU 4")
+            (-1, -1)
+            >>> IINRangeTable.to_key("41111 ABC")
+            -1
+        """
+        digits = re.match(r"\d*", re.sub(r"[ -]", "", card_number)).group()
+        if len(digits) < cls.MIN_DIGITS:
+            return -1
+        return int(digits[:cls.KEY_DIGITS].ljust(cls.KEY_DIGITS, "0"))
+
+    def lookup(self, card_number: str) -> str:
+        """Payment network of a card number
+
+        Args:
+            card_number (str): card number or at least its first digits
+
+        Returns:
+            str | None: the name of the payment network or None if the number is
+        not inside any range
+        """
+        return self.lookup_keys(np.array([self.to_key(card_number)], dtype=np.int64))[0]
+
+    def lookup_many(self, card_numbers: Iterable[str]) -> np.ndarray:
+        keys = np.fromiter((self.to_key(number) for number in card_numbers), dtype=np.int64)
+        return self.lookup_keys(keys)
+
+    def lookup_keys(self, keys: np.ndarray) -> np.ndarray:
+        """Vectorized lookup of many keys (card numbers prefixes of KEY_DIGITS digits)
+
+        Args:
+            keys (np.ndarray): int64 array of keys
+
+        Returns:
+            np.ndarray: object array with the payment network of each key or None
+        """
+        idx = np.searchsorted(self.starts, keys, side="right") - 1
+        found = (idx >= 0) & (keys <= self.ends[np.maximum(idx, 0)]) if len(self) else np.zeros(len(keys), dtype=bool)
+        networks = np.full(len(keys), None, dtype=object)
+        networks[found] = self.networks[idx[found]]
+        return networks
+
+
+def valid_pan(card_number: str) -> bool:
+    """Whether a card number is a full PAN: 13 to 19 digits, optionally grouped
+    with spaces or dashes, that pass the Luhn check
+
+    Examples:
+        >>> valid_pan("4111 1111 1111 1111")
+        True
+        >>> valid_pan("4111 1111 1111 1112"), valid_pan("411111"), valid_pan("4111 1111 1111 111I")
+        (False, False, False)
+    """
+    digits = re.sub(r"[ -]", "", card_number or "")
+    if not (digits.isdigit() and 13 <= len(digits) <= 19):
+        return False
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if i % 2 else 1)
+        total += value - 9 if value > 9 else value
+    return total % 10 == 0
+
+
+_table = None
+_table_lock = threading.Lock()
+
+def get_iin_range_table() -> IINRangeTable:
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = IINRangeTable.load(config.IIN_RANGES_PATH)
+    return _table
@@ -0,0 +1,206 @@
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from src.config.config import Config
+from src.utils.logger import get_logger
+import os
+import requests
+import sqlite3
+import threading
+import time
+
+config = Config()
+logger = get_logger(__name__)
+
+# Value stored for the IINs that BINLIST does not know (negative cache)
+UNKNOWN = ""
+
+
+class IINResolver:
+    """Resolves the payment network of an IIN (first 6 digits of a card number)
+
+    The lookup goes through three levels:
+        1. In-memory LRU with TTL
+        2. Persistent SQLite store, shared by the processes of the node
+        3. BINLIST API through a pooled session with strict timeouts
+
+    The IINs unknown to BINLIST are cached too (with a shorter TTL). When the API
+    fails or times out it is not called again during a cooldown period, the
+    resolver returns None and the caller falls back to the local rules.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(IINResolver, cls).__new__(cls)
+                    instance._init()
+                    cls._instance = instance
+        return cls._instance
+
+    def _init(self) -> None:
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = self._open_db(config.IIN_CACHE_DB)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.BINLIST_POOL_SIZE, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update({"Accept-Version": "3"})
+        self._remote_disabled_until = 0.0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "remote_calls": 0,
+            "remote_errors": 0,
+            "remote_skipped": 0,
+        }
+
+    @staticmethod
+    def _open_db(path: str):
+        if not path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, timeout=1.0)
+            db.execute("CREATE TABLE IF NOT EXISTS iin_cache "
+                       "(iin TEXT PRIMARY KEY, network TEXT NOT NULL, expires_at REAL NOT NULL)")
+            db.commit()
+            return db
+        except sqlite3.Error as e:
+            logger.warning("Can't open the IIN cache database %s: %s", path, e)
+            return None
+
+    def _count(self, key: str) -> None:
+        with self._memory_lock:
+            self._stats[key] += 1
+
+    def _get_memory(self, iin: str):
+        with self._memory_lock:
+            item = self._memory.get(iin)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                del self._memory[iin]
+                return None
+            self._memory.move_to_end(iin)
+            self._stats["memory_hits"] += 1
+            return item[0]
+
+    def _set_memory(self, iin: str, network: str, expires_at: float) -> None:
+        with self._memory_lock:
+            self._memory[iin] = (network, expires_at)
+            self._memory.move_to_end(iin)
+            while len(self._memory) > config.IIN_CACHE_SIZE:
+                self._memory.popitem(last=False)
+
+    def _get_disk(self, iin: str):
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT network, expires_at FROM iin_cache WHERE iin = ?",
+                                       (iin,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        self._count("disk_hits")
+        self._set_memory(iin, row[0], row[1])
+        return row[0]
+
+    def _set(self, iin: str, network: str, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        self._set_memory(iin, network, expires_at)
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute("INSERT OR REPLACE INTO iin_cache (iin, network, expires_at) VALUES (?, ?, ?)",
+                                 (iin, network, expires_at))
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Can't save the IIN %s in the cache: %s", iin, e)
+
+    def _fetch(self, api_url: str, iin: str):
+        """Ask BINLIST for the IIN
+
+        Returns:
+            str | None: the payment network, UNKNOWN if BINLIST does not know the
+        IIN or None if the request failed
+        """
+        if time.monotonic() < self._remote_disabled_until:
+            self._count("remote_skipped")
+            return None
+        self._count("remote_calls")
+        try:
+            response = self._session.get(f"{api_url}/{iin}",
+                                         timeout=(config.BINLIST_CONNECT_TIMEOUT, config.BINLIST_READ_TIMEOUT))
+            if response.status_code == 404:
+                return UNKNOWN
+            response.raise_for_status()
+            return self._to_payment_network(scheme=response.json().get("scheme")) or UNKNOWN
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Error in the request to API: %s", e)
+            self._count("remote_errors")
+            # Don't wait for the timeout of a slow or down service on each lookup
+            self._remote_disabled_until = time.monotonic() + config.BINLIST_COOLDOWN
+            return None
+
+    @staticmethod
+    def _to_payment_network(scheme: str) -> str:
+        if not scheme:
+            return None
+        if scheme.startswith("visa"):
+            return config.VISA_CONSTANT
+        elif scheme.startswith("mastercard"):
+            return config.MASTERCARD_CONSTANT
+        elif scheme.startswith("american"):
+            return config.AMERCIAN_EXPRESS_CONSTANT
+        elif scheme.startswith("discover"):
+            return config.DISCOVER_CONSTANT
+        elif scheme.startswith("jcb"):
+            return config.JCB_CONSTANT
+        elif scheme.startswith("diners"):
+            return config.DINERS_CLUB_CONSTANT
+        elif scheme.startswith("maestro"):
+            return config.MAESTRO_CONSTANT
+        elif scheme.startswith("unionpay"):
+            return config.UNIONPAY_CONSTANT
+        else:
+            return config.CABAL_CONSTANT
+
+    def resolve(self, api_url: str, card_number: str) -> str:
+        """Resolve the payment network of a card number by its IIN
+
+        Args:
+            api_url (str): url of the BINLIST API
+            card_number (str): card number, at least its first 6 digits
+
+        Returns:
+            str | None: the name of the payment network or None if can not determine it
+        """
+        iin = card_number[:6]
+        if len(iin) < 6 or not iin.isdigit():
+            return None
+
+        network = self._get_memory(iin)
+        if network is None:
+            network = self._get_disk(iin)
+        if network is None:
+            network = self._fetch(api_url=api_url, iin=iin)
+            if network is None:
+                return None
+            self._set(iin, network, config.IIN_CACHE_TTL if network != UNKNOWN else config.IIN_NEGATIVE_TTL)
+        return network if network != UNKNOWN else None
+
+    def stats(self) -> dict:
+        with self._memory_lock:
+            return {"memory_size": len(self._memory), **self._stats}
+
+
+def get_iin_resolver():
+    return IINResolver()
@@ -0,0 +1,161 @@
+from pathlib import Path
+from src.config.config import Config
+from src.utils.logger import get_logger
+from typing import TYPE_CHECKING
+import shutil
+import tempfile
+
+config = Config()
+logger = get_logger(__name__)
+
+# ultralytics imports torch, it is imported when the first model is loaded
+if TYPE_CHECKING:
+    from ultralytics import YOLO
+
+# Ultralytics export format of each backend
+BACKENDS = {
+    "torch": None,
+    "onnx": "onnx",
+    "openvino": "openvino",
+}
+
+
+# Precisions of the models. fp16 and int8 are variants exported next to the fp32 one
+PRECISIONS = ("fp32", "fp16", "int8")
+
+
+def exported_path(weights: str, backend: str, precision: str = "fp32") -> str:
+    """Path of the export of the weights for a backend and a precision
+
+    Args:
+        weights (str): path of the PyTorch weights
+        backend (str): name of the backend
+        precision (str, optional): "fp32", "fp16" or "int8". Default value is "fp32"
+
+    Returns:
+        str: path of the exported model (a file for onnx, a directory for openvino)
+    """
+    path = Path(weights)
+    variant = "" if precision == "fp32" else precision
+    if backend == "onnx":
+        return str(path.with_suffix(f".{variant}.onnx" if variant else ".onnx"))
+    if backend == "openvino":
+        return str(path.with_suffix("").as_posix() + (f"_{variant}" if variant else "") + "_openvino_model")
+    return str(path)
+
+
+def _is_fresh(target: Path, weights: str) -> bool:
+    return target.exists() and target.stat().st_mtime >= Path(weights).stat().st_mtime
+
+
+def _quantize_onnx(weights: str, target: Path, **export_args) -> str:
+    # Dynamic quantization: int8 weights, the activations are quantized at runtime,
+    # so it does not need calibration images
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model = export_model(weights=weights, backend="onnx", precision="fp32", **export_args)
+    logger.info("Quantizing %s to int8", model)
+    quantize_dynamic(model_input=model, model_output=str(target), weight_type=QuantType.QUInt8)
+    return str(target)
+
+
+def export_model(weights: str, backend: str, precision: str = "fp32", task: str = None, **export_args) -> str:
+    """Export the PyTorch weights to the format and precision of the backend, if
+    there is not an export newer than the weights
+
+    int8 uses dynamic quantization with ONNX Runtime and static quantization with
+    OpenVINO, calibrated with the Ultralytics dataset of YOLO_INT8_DATA_DETECT or
+    YOLO_INT8_DATA_CLASSIFY (the Ultralytics sample dataset of the task when empty).
+
+    Args:
+        weights (str): path of the PyTorch weights
+        backend (str): "torch", "onnx" or "openvino"
+        precision (str, optional): "fp32", "fp16" or "int8". Default value is "fp32"
+        task (str, optional): task of the model, selects the calibration dataset of int8
+        export_args: extra arguments of YOLO.export (imgsz, dynamic...)
+
+    Raises:
+        ValueError: if the backend or the precision is not supported
+
+    Returns:
+        str: path of the model to load for the backend
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Inference backend not supported: {backend}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precision not supported: {precision}")
+    if BACKENDS[backend] is None:
+        return weights
+
+    target = Path(exported_path(weights=weights, backend=backend, precision=precision))
+    if _is_fresh(target=target, weights=weights):
+        return str(target)
+
+    if backend == "onnx" and precision == "int8":
+        return _quantize_onnx(weights=weights, target=target, **export_args)
+
+    logger.info("Exporting %s to %s %s", weights, backend, precision)
+    # Dynamic axes, so the exported model accepts the batches of the micro-batcher
+    export_args.setdefault("dynamic", backend == "onnx")
+    if precision == "fp16":
+        export_args["half"] = True
+    elif precision == "int8":
+        export_args["int8"] = True
+        data = config.YOLO_INT8_DATA.get(task)
+        if data:
+            export_args.setdefault("data", data)
+
+    from ultralytics import YOLO
+
+    # Export a copy of the weights, so the variants do not overwrite the fp32 export
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy = shutil.copy(weights, tmp_dir)
+        exported = YOLO(model=copy, task=task).export(format=BACKENDS[backend], **export_args)
+        if target.exists():
+            shutil.rmtree(target) if target.is_dir() else target.unlink()
+        shutil.move(str(exported).rstrip("/\\"), str(target))
+    return str(target)
+
+
+def load_yolo(weights: str, task: str, backend: str = None, precision: str = None, device: str = None,
+              **export_args) -> "YOLO":
+    """Load a YOLO model with the configured inference backend and precision
+
+    The exported models are loaded with the same YOLO wrapper, so the results keep
+    the same format (boxes, probs...) whatever the backend.
+
+    Args:
+        weights (str): path of the PyTorch weights
+        task (str): task of the model, "detect" or "classify"
+        backend (str, optional): name of the backend. Default value is YOLO_BACKEND
+        precision (str, optional): "fp32", "fp16" or "int8". Default value is YOLO_PRECISION
+        device (str, optional): device of the inferences ("cpu", "cuda:1"...). Default value
+    is the device that Ultralytics chooses on each call
+
+    Raises:
+        ValueError: if the backend does not support the precision
+
+    Returns:
+        YOLO: the model ready to make inference
+    """
+    from ultralytics import YOLO
+
+    backend = backend or config.YOLO_BACKEND
+    precision = precision or config.YOLO_PRECISION
+    if backend == "torch":
+        if precision == "int8":
+            raise ValueError("The torch backend does not support int8, use onnx or openvino")
+        model = YOLO(model=weights)
+        # Half precision inference, Ultralytics only applies it on GPU
+        if precision == "fp16":
+            model.overrides["half"] = True
+    else:
+        model = YOLO(model=export_model(weights=weights, backend=backend, precision=precision,
+                                        task=task, **export_args), task=task)
+    if device:
+        # Every call of the model runs on the device, unless the call sets its own
+        model.overrides["device"] = device
+        if backend == "torch":
+            # Place the weights now, so the memory of the model is taken at load time
+            model.to(device)
+    return model
@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from src.config.config import Config
+from src.utils.logger import get_logger
+from typing import Tuple
+import os
+import time
+
+config = Config()
+logger = get_logger(__name__)
+
+# Latencies from a few milliseconds (IIN lookup) to tens of seconds (GroundingDINO on CPU)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram("card_service_stage_seconds",
+                          "Time of each stage of the pipelines",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+MODEL_SECONDS = Histogram("card_service_model_inference_seconds",
+                          "Time of each inference of a model of the registry",
+                          ["model"], buckets=LATENCY_BUCKETS)
+OUTCOMES = Counter("card_service_outcomes_total",
+                   "Result of each processed image: invalid image or the source of the payment network",
+                   ["pipeline", "outcome"])
+# The gauges are summed over the live workers of the preforking server
+IN_FLIGHT = Gauge("card_service_in_flight_requests",
+                  "Requests that are being processed",
+                  ["endpoint"], multiprocess_mode="livesum")
+EXECUTOR_PENDING = Gauge("card_service_executor_pending_jobs",
+                         "Jobs running or waiting in the inference executor",
+                         multiprocess_mode="livesum")
+
+INVALID_IMAGE = "invalid_image"
+NETWORK_IIN = "network_iin"
+NETWORK_SIFT = "network_sift"
+NETWORK_CLASSIFIER = "network_classifier"
+NETWORK_UNKNOWN = "network_unknown"
+
+_tracer = None
+_tracer_ready = False
+
+
+def get_tracer():
+    """OpenTelemetry tracer of the service, None when OTEL_TRACING is disabled
+    or the opentelemetry-api package is not installed. The exporter is set up by
+    the OpenTelemetry SDK of the deployment (opentelemetry-instrument...)"""
+    global _tracer, _tracer_ready
+    if not _tracer_ready:
+        _tracer_ready = True
+        if config.OTEL_TRACING:
+            try:
+                from opentelemetry import trace
+                _tracer = trace.get_tracer(config.OTEL_SERVICE_NAME)
+            except ImportError:
+                logger.warning("OTEL_TRACING is enabled but opentelemetry-api is not installed")
+    return _tracer
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Context manager that records the time of a stage in STAGE_SECONDS and, when
+    tracing is enabled, wraps the stage in an OpenTelemetry span
+
+    Args:
+        name (str): name of the stage ("card_detect", "ocr_card_number"...)
+        attributes: attributes of the span
+    """
+    tracer = get_tracer()
+    start = time.perf_counter()
+    if tracer is None:
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.labels(stage=name).observe(time.perf_counter() - start)
+        return
+    with tracer.start_as_current_span(name, attributes=attributes):
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.labels(stage=name).observe(time.perf_counter() - start)
+
+
+def observe_model(name: str, elapsed: float) -> None:
+    MODEL_SECONDS.labels(model=name).observe(elapsed)
+
+
+def count_outcome(pipeline: str, outcome: str, count: int = 1) -> None:
+    OUTCOMES.labels(pipeline=pipeline, outcome=outcome).inc(count)
+
+
+def in_flight(endpoint: str):
+    """Context manager that counts the request in IN_FLIGHT while it runs"""
+    return IN_FLIGHT.labels(endpoint=endpoint).track_inprogress()
+
+
+def render() -> Tuple[bytes, str]:
+    """Metrics in the Prometheus text format and its content type. With
+    PROMETHEUS_MULTIPROC_DIR (preforking server) they are the sum of every worker"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
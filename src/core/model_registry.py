@@ -0,0 +1,228 @@
+from src.config.config import Config
+from src.core.metrics import observe_model
+from src.utils.logger import get_logger
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+import os
+import sys
+import threading
+import time
+
+config = Config()
+logger = get_logger(__name__)
+
+
+def select_device(device: str = None) -> str:
+    """Resolve the device where the models are going to be placed
+
+    Args:
+        device (str, optional): requested device ("auto", "cpu", "cuda", "cuda:1"...).
+    Default value is the DEVICE setting
+
+    Returns:
+        str: the resolved device name
+    """
+    device = device or config.DEVICE
+    if device != "auto":
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def rss_bytes() -> int:
+    """Resident memory of the process, 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def pss_bytes() -> int:
+    """Proportional set size of the process: the pages shared with other processes
+    (like the weights shared by the forked workers) count split between them"""
+    try:
+        with open("/proc/self/smaps_rollup") as file:
+            for line in file:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def cuda_bytes(device: str) -> int:
+    """Memory allocated by torch on a CUDA device, 0 for the other devices"""
+    # torch is imported by the loaders, it is not imported only to measure
+    torch = sys.modules.get("torch")
+    if not device.startswith("cuda") or torch is None or not torch.cuda.is_available():
+        return 0
+    return torch.cuda.memory_allocated(device)
+
+
+def warmup_names() -> List[str]:
+    """Names of the models of WARMUP_MODELS, "all" is every registered model"""
+    if not config.WARMUP_MODELS:
+        return []
+    if config.WARMUP_MODELS == "all":
+        return get_model_registry().names()
+    return [name.strip() for name in config.WARMUP_MODELS.split(",") if name.strip()]
+
+
+class ModelRegistry:
+    """Process-wide registry of heavy models
+
+    Each model is registered with a loader function and it is built the first time
+    that someone asks for it. The load happens only once per process even if many
+    threads ask for the same model at the same time. Each model is placed on its
+    device of MODEL_DEVICES, or on the DEVICE of the registry. The registry also
+    keeps load and inference timings of each model and the memory taken by its load
+    (process RSS and CUDA memory), the memory is only exact when the models are
+    loaded one at a time, like the warmup does.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(ModelRegistry, cls).__new__(cls)
+                    instance._loaders = {}
+                    instance._models = {}
+                    instance._model_locks = {}
+                    instance._metrics = {}
+                    instance._fixed_devices = {}
+                    instance._device = None
+                    cls._instance = instance
+        return cls._instance
+
+    @property
+    def device(self) -> str:
+        # The device is chosen once and shared by every model of the process
+        if self._device is None:
+            with self._lock:
+                if self._device is None:
+                    self._device = select_device()
+                    logger.info("Model registry device --- %s", self._device)
+        return self._device
+
+    def device_for(self, name: str) -> str:
+        """Device of a model: its fixed device, from MODEL_DEVICES or the device of the registry"""
+        if name in self._fixed_devices:
+            return self._fixed_devices[name]
+        if name in config.MODEL_DEVICES:
+            return select_device(config.MODEL_DEVICES[name])
+        return self.device
+
+    def register(self, name: str, loader: Callable[[str], object], device: str = None) -> None:
+        """Register a model loader. The loader receives the device name and
+        returns the loaded model
+
+        Args:
+            name (str): unique name of the model
+            loader (Callable[[str], object]): function that builds the model
+            device (str, optional): device of a model that always runs there, like the
+        models of OpenCV on "cpu". It is not resolved, so torch is not imported to
+        load them. Default value places the model with MODEL_DEVICES or DEVICE
+        """
+        with self._lock:
+            if name not in self._loaders:
+                self._loaders[name] = loader
+                if device is not None:
+                    self._fixed_devices[name] = device
+                self._model_locks[name] = threading.Lock()
+                self._metrics[name] = {
+                    "loaded": False,
+                    "device": None,
+                    "load_time_s": None,
+                    "memory_rss_mb": None,
+                    "memory_cuda_mb": None,
+                    "inference_count": 0,
+                    "inference_total_s": 0.0,
+                    "inference_last_s": None,
+                }
+
+    def get(self, name: str) -> object:
+        """Return the model registered with the name, loading it if it is needed
+
+        Args:
+            name (str): name of the model
+
+        Raises:
+            KeyError: if there is not a model registered with that name
+
+        Returns:
+            object: the loaded model
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"Model not registered: {name}")
+
+        with self._model_locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                device = self.device_for(name)
+                rss, cuda = rss_bytes(), cuda_bytes(device)
+                start = time.perf_counter()
+                model = self._loaders[name](device)
+                elapsed = time.perf_counter() - start
+                self._models[name] = model
+                metrics = self._metrics[name]
+                metrics["loaded"] = True
+                metrics["device"] = device
+                metrics["load_time_s"] = elapsed
+                metrics["memory_rss_mb"] = (rss_bytes() - rss) / 2 ** 20
+                metrics["memory_cuda_mb"] = (cuda_bytes(device) - cuda) / 2 ** 20
+                logger.info("Model %s loaded on %s in %.3fs (%.0f MB RSS, %.0f MB CUDA)", name, device, elapsed,
+                            metrics["memory_rss_mb"], metrics["memory_cuda_mb"])
+        return model
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._loaders.keys())
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    @contextmanager
+    def timed(self, name: str):
+        """Context manager that records the time of an inference of a model"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            observe_model(name=name, elapsed=elapsed)
+            with self._lock:
+                metrics = self._metrics[name]
+                metrics["inference_count"] += 1
+                metrics["inference_total_s"] += elapsed
+                metrics["inference_last_s"] = elapsed
+
+    def warmup(self, names: List[str] = None) -> None:
+        """Load the models before the first request arrives
+
+        Args:
+            names (List[str], optional): names of the models to load. If it is None
+        every registered model is loaded
+        """
+        for name in names or list(self._loaders.keys()):
+            self.get(name)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            stats = {}
+            for name, metrics in self._metrics.items():
+                stats[name] = dict(metrics)
+                count = metrics["inference_count"]
+                stats[name]["inference_mean_s"] = metrics["inference_total_s"] / count if count else None
+            return {"device": self._device, "pid": os.getpid(), "rss_mb": rss_bytes() / 2 ** 20,
+                    "pss_mb": pss_bytes() / 2 ** 20, "models": stats}
+
+
+def get_model_registry():
+    return ModelRegistry()
@@ -0,0 +1,215 @@
+"""Model server: one process that loads the models and runs the pipelines for
+the API and the demo
+
+The clients send the decoded image to the server over a Unix socket
+(MODEL_SERVER_ADDRESS) and receive the CreditCardData, so a node keeps a single
+copy of every model whatever the number of API workers and demos. Without
+MODEL_SERVER_ADDRESS the pipelines run in the process that calls them.
+
+Usage (from src/api, like the service):
+    MODEL_SERVER_ADDRESS=/tmp/card-models.sock MODEL_SERVER_AUTHKEY=<secret> WARMUP_MODELS=all python -m src.core.model_server
+"""
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from src.config.config import Config
+from src.core.model_registry import get_model_registry, warmup_names
+from src.core.resolution import get_pixel_stats
+from src.utils.logger import get_logger
+from typing import Callable, Dict
+import os
+import sys
+import threading
+
+config = Config()
+logger = get_logger(__name__)
+
+
+class ModelServerError(RuntimeError):
+    """The model server is not reachable or the pipeline failed in the server"""
+
+
+def pipelines() -> Dict[str, Callable]:
+    """Functions that the model server runs for its clients"""
+    # The pipelines register their models when they are imported
+    from src.core.card_pipeline import process_image, process_images
+    from src.core.credit_card_processor import process_credit_card
+    return {
+        "v1": process_credit_card,
+        "v2": process_image,
+        "v2_batch": process_images,
+        "stats": server_stats,
+        "ping": lambda: True,
+    }
+
+
+def server_stats() -> dict:
+    return {**get_model_registry().stats(), "pixels": get_pixel_stats().stats()}
+
+
+def _authkey() -> bytes:
+    return config.MODEL_SERVER_AUTHKEY.encode() if config.MODEL_SERVER_AUTHKEY else None
+
+
+class ModelServer:
+    """Serves the pipelines of the service over a Unix socket
+
+    Each connection is served by its own thread, so the pipelines of many clients
+    run at the same time and share the micro-batchers, the reader pool and the
+    caches of the process, like the requests of the API do in a single process.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.functions = pipelines()
+
+    def serve_forever(self) -> None:
+        # The connections carry pickles, a client without the key could run any code here
+        if not _authkey():
+            raise EnvironmentError("MODEL_SERVER_AUTHKEY is required to run the model server")
+        # A socket left by a previous run would make the bind fail
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # Only the user of the server can connect to the socket (0600)
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(address=self.address, family="AF_UNIX", authkey=_authkey())
+        finally:
+            os.umask(umask)
+        with listener:
+            logger.info("Model server listening on %s", self.address)
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    logger.warning("Model server rejected a connection: %s", e)
+                    continue
+                threading.Thread(target=self._serve, args=(connection,), name="model-server", daemon=True).start()
+
+    def _serve(self, connection: Connection) -> None:
+        with connection:
+            while True:
+                try:
+                    method, kwargs = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ("ok", self.functions[method](**kwargs))
+                except Exception as e:
+                    logger.exception("Model server call %s failed", method)
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                try:
+                    connection.send(reply)
+                except OSError:
+                    return
+
+
+class ModelClient:
+    """Client of the model server, each thread keeps its own connection"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(ModelClient, cls).__new__(cls)
+                    instance.address = config.MODEL_SERVER_ADDRESS
+                    instance._local = threading.local()
+                    cls._instance = instance
+        return cls._instance
+
+    def _connection(self) -> Connection:
+        # A forked worker (process executor) opens its own connection
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.connection = Client(address=self.address, family="AF_UNIX", authkey=_authkey())
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _reset(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and getattr(self._local, "pid", None) == os.getpid():
+            connection.close()
+        self._local.pid = None
+
+    def call(self, method: str, **kwargs) -> object:
+        """Run a function of the model server
+
+        Args:
+            method (str): name of the function ("v1", "v2", "v2_batch", "stats")
+            kwargs: arguments of the function, they are pickled
+
+        Raises:
+            ModelServerError: if the server is not reachable or the function failed
+
+        Returns:
+            object: the result of the function
+        """
+        # A connection closed by a restart of the server is opened again once
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.send((method, kwargs))
+                status, value = connection.recv()
+                break
+            except (OSError, EOFError, AuthenticationError) as e:
+                self._reset()
+                if attempt:
+                    raise ModelServerError(f"Model server {self.address} not available: {e}") from e
+        if status == "error":
+            raise ModelServerError(value)
+        return value
+
+    def ping(self) -> bool:
+        try:
+            return self.call("ping")
+        except ModelServerError:
+            return False
+
+
+def get_model_client():
+    return ModelClient()
+
+
+def run_pipeline(name: str, **kwargs) -> object:
+    """Run a pipeline in the model server when MODEL_SERVER_ADDRESS is set,
+    else in this process
+
+    Args:
+        name (str): "v1", "v2" (one image) or "v2_batch" (list of images)
+        kwargs: arguments of the pipeline (img or imgs)
+    """
+    if config.MODEL_SERVER_ADDRESS:
+        return get_model_client().call(name, **kwargs)
+    return pipelines()[name](**kwargs)
+
+
+def models_stats() -> dict:
+    """Stats of the models that serve the requests of this process"""
+    if not config.MODEL_SERVER_ADDRESS:
+        return get_model_registry().stats()
+    try:
+        return get_model_client().call("stats")
+    except ModelServerError as e:
+        return {"error": str(e)}
+
+
+def main() -> int:
+    if not config.MODEL_SERVER_ADDRESS:
+        logger.error("MODEL_SERVER_ADDRESS is required to run the model server")
+        return 1
+    if not config.MODEL_SERVER_AUTHKEY:
+        logger.error("MODEL_SERVER_AUTHKEY is required to run the model server")
+        return 1
+    server = ModelServer(address=config.MODEL_SERVER_ADDRESS)
+    if config.MODEL_SERVER_METRICS_PORT:
+        from prometheus_client import start_http_server
+        start_http_server(config.MODEL_SERVER_METRICS_PORT)
+    # The socket is opened when the models of WARMUP_MODELS (all by default) are
+    # loaded, so its file means ready
+    get_model_registry().warmup(warmup_names() or None)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,12 @@
 from abc import ABC, abstractmethod
+from src.core.reference_index import SIFTReferenceIndex
+from src.core.logo_matcher import LogoMatcher
+from src.utils.logger import get_logger
 import cv2
 import numpy as np
 
+logger = get_logger(__name__)
+
 class ObjectDetector(ABC):
     @abstractmethod
     def set_target_image(self, image_path):
@@ -19,7 +24,7 @@ class SIFTObjectDetector(ObjectDetector):
         self.target_image = None
         self.target_kp = None
         self.target_des = None
-        self.reference_images = {}
+        self.matcher = None
         self.match_threshold = match_threshold
         self.lowe_ratio = lowe_ratio
 
@@ -41,38 +46,29 @@ class SIFTObjectDetector(ObjectDetector):
         self.target_kp, self.target_des = self.sift.detectAndCompute(self.target_image, None)
 
     def load_reference_images(self, image_paths):
-        for name, path in image_paths.items():
-            image = cv2.imread(path)
-            processed_image = self.preprocess_image(image)
-            kp, des = self.sift.detectAndCompute(processed_image, None)
-            self.reference_images[name] = {
-                'image': processed_image, 
-                'kp': kp, 
-                'des': des, 
-                'original': image
-            }
+        # Prefer set_reference_index with a shared index, this computes the
+        # descriptors of every reference image again
+        self.set_reference_index(SIFTReferenceIndex.build(patterns=image_paths,
+                                                          preprocess=self.preprocess_image))
+
+    def set_reference_index(self, index: SIFTReferenceIndex, mode: str = LogoMatcher.EXACT):
+        self.matcher = LogoMatcher(index=index, mode=mode)
+
+    def set_matcher(self, matcher: LogoMatcher):
+        self.matcher = matcher
 
     def detect(self):
-        if self.target_image is None or not self.reference_images:
+        if self.target_image is None or self.matcher is None:
             raise ValueError("Target image and reference images must be loaded before detection")
         
-        best_match = None
-        max_good_matches = 0
-        
-        for name, ref in self.reference_images.items():
-            bf = cv2.BFMatcher()
-            matches = bf.knnMatch(ref['des'], self.target_des, k=2)
-            
-            good_matches = []
-            for m, n in matches:
-                if m.distance < self.lowe_ratio * n.distance:
-                    good_matches.append(m)
-            
-            print(f"{name}: {len(good_matches)} good matches")
-            
-            if len(good_matches) > max_good_matches:
-                max_good_matches = len(good_matches)
-                best_match = name
+        # Good matches of every reference logo in a single pass
+        counts = self.matcher.count_good_matches(self.target_des, lowe_ratio=self.lowe_ratio)
+        for name, count in zip(self.matcher.index.names, counts):
+            logger.debug("%s: %s good matches", name, count)
+
+        best = int(np.argmax(counts)) if len(counts) else 0
+        max_good_matches = int(counts[best]) if len(counts) else 0
+        best_match = self.matcher.index.names[best] if max_good_matches > 0 else None
 
         # Verificar si el mejor match supera el umbral
         if max_good_matches >= self.match_threshold:
@@ -1,69 +1,312 @@
 from src.models.model import CreditCardData
-from src.utils.file_utils import extract_zone, preprocess_img
+from src.core.pipeline_context import PipelineContext
+from src.core.model_registry import get_model_registry
+from src.core.resolution import fit_height, get_pixel_stats, pixels
+from src.core import metrics
+from src.config.config import Config
+from src.utils.logger import get_logger, mask_card_number
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Tuple, Dict
-import easyocr
+from typing import List, Tuple, Dict, TYPE_CHECKING
 import numpy as np
+import cv2
+import queue
 import re
+import threading
+
+config = Config()
+logger = get_logger(__name__)
+
+if TYPE_CHECKING:
+    import easyocr
+
+OCR_MODEL_NAME = "easyocr_readers"
+
+class ReaderPool:
+    """Pool of easyocr.Reader instances
+
+    A reader is not safe to use from many threads at the same time, so each
+    request borrows one reader of the pool and gives it back when it finishes.
+    The readers are created on demand until the size of the pool is reached,
+    after that the requests wait for a free reader.
+    """
+
+    def __init__(self, size: int, factory: callable):
+        self.size = max(1, size)
+        self._factory = factory
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return self._factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def acquire(self):
+        reader = self._take()
+        try:
+            yield reader
+        finally:
+            self._idle.put(reader)
+
+    def prefill(self, count: int = 1) -> None:
+        with self._lock:
+            missing = max(0, min(count, self.size) - self._created)
+            self._created += missing
+        for created in range(missing):
+            try:
+                self._idle.put(self._factory())
+            except Exception:
+                with self._lock:
+                    self._created -= missing - created
+                raise
+
+def load_reader_pool(device: str) -> ReaderPool:
+    # easyocr imports torch, it is imported when the first reader is built
+    import easyocr
+    gpu = False if device == "cpu" else device
+    pool = ReaderPool(size=config.OCR_READER_POOL_SIZE,
+                      factory=lambda: easyocr.Reader(['en'], gpu=gpu,
+                                                     quantize=config.OCR_QUANTIZE))
+    # The first reader is created with the pool, so the weights are ready
+    pool.prefill(count=1)
+    return pool
+
+registry = get_model_registry()
+registry.register(OCR_MODEL_NAME, load_reader_pool)
 
 class OCRService:
     _instance = None
 
+    # Fields read from each card and the method that formats their text
+    FORMATTERS = {
+        'card_number': '_format_card_number',
+        'cardholder': '_format_card_name',
+        'expiry_date': '_format_expiration_date'
+    }
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(OCRService, cls).__new__(cls)
-            cls._instance.reader = easyocr.Reader(['en'])
-            cls._instance.img = None
-            cls._instance.elements = None
-            cls._instance.zones = None
         return cls._instance
 
-    def set_img(self, img: np.ndarray) -> None:
-        self.img = preprocess_img(image=img)
-
-    def set_images(self, elements: dict) -> None:
-        self.elements = elements
-
-    def set_zones_coords(self, zones: Dict[str, Tuple[int, int, int, int]]) -> None:
-        self.zones = zones
+    @property
+    def readers(self) -> ReaderPool:
+        return registry.get(OCR_MODEL_NAME)
 
-    def _extract_text(self, zone_name: str) -> List[Tuple]:
-        if self.img is None or self.zones is None or self.elements == {}:
-            raise ValueError("Image and zones and elements must be set before extraction")
-        if self.elements[zone_name] is None:
-            zone = extract_zone(img=self.img, zone=self.zones[zone_name])
-        else:
-            zone = self.elements[zone_name]
-        return self.reader.readtext(zone)
+    @staticmethod
+    def _get_region(context: PipelineContext, elements: dict, zones: dict, zone_name: str) -> tuple:
+        """Key and image of the region where a field is read: the element
+        detected on the card or else the zone of the preprocessed card, and
+        whether the region is a detected element (a tight box around the text)"""
+        if elements.get(zone_name) is not None:
+            return context.element_key(zone_name), elements[zone_name], True
+        if zones is None or zone_name not in zones:
+            raise ValueError(f"Element or zone coords must be provided for {zone_name}")
+        return context.zone_key(zones[zone_name]), context.zone(zones[zone_name]), False
 
     def _format_text(self, results: List[Tuple], formatter: callable) -> str:
         return formatter([text for _, text, _ in results])
 
-    def get_credit_card_number(self, img: np.ndarray, zone: Tuple[int, int, int, int]) -> str:
-        number_zone = extract_zone(img=preprocess_img(image=img), zone=zone)
-        results = self.reader.readtext(number_zone)
-        return self._format_text(results, self._format_card_number)
+    def get_credit_card_number(self, img: np.ndarray, zone: Tuple[int, int, int, int],
+                               context: PipelineContext = None) -> str:
+        context = context if context is not None else PipelineContext(card=img)
+        key = context.zone_key(zone)
+        if not context.has_ocr(key):
+            with self.readers.acquire() as reader, registry.timed(OCR_MODEL_NAME):
+                context.set_ocr(key, self._read(reader=reader, crops=[context.zone(zone)],
+                                                fields=["card_number"])[0])
+        return self._format_text(context.get_ocr(key), self._format_card_number)
+
+    def _read(self, reader: "easyocr.Reader", crops: List[np.ndarray], fields: List[str] = None,
+              tight: List[bool] = None) -> List[List[Tuple]]:
+        """Read the text of each crop
+
+        With OCR_MODE "recognize" the tight crops (the elements detected by YOLO)
+        are stacked in a single canvas and the recognizer reads all of them in one
+        call, without running the CRAFT text detector. The crops taller than
+        OCR_MAX_HEIGHT are downscaled first. The zones of the card are not tight
+        boxes around the text, so they always run detection + recognition
+        (readtext), like every crop with OCR_MODE "readtext".
+
+        Args:
+            reader (easyocr.Reader): reader borrowed from the pool
+            crops (List[np.ndarray]): images to read
+            fields (List[str], optional): field of each crop, it names the metrics stage
+        of each crop read with readtext
+            tight (List[bool], optional): whether each crop is a detected element. Default
+        value is False for every crop (zones)
+
+        Returns:
+            List[List[Tuple]]: for each crop a list of (box, text, confidence)
+        """
+        fields = fields or ["region"] * len(crops)
+        tight = tight or [False] * len(crops)
+        results = [[] for _ in crops]
+        # An element or zone out of the card gives an empty crop, it has no text
+        valid = [i for i, crop in enumerate(crops) if crop is not None and crop.size > 0]
+        stacked = [i for i in valid if tight[i] and config.OCR_MODE == "recognize"]
+
+        for i in valid:
+            if i in stacked:
+                continue
+            crop_pixels = pixels(crops[i])
+            get_pixel_stats().record(stage="ocr", input_pixels=crop_pixels, processed_pixels=crop_pixels)
+            with metrics.stage(f"ocr_{fields[i]}"):
+                results[i] = reader.readtext(crops[i])
+
+        if stacked:
+            for i, crop_results in zip(stacked, self._recognize(reader=reader, crops=[crops[i] for i in stacked])):
+                results[i] = crop_results
+        return results
+
+    def _recognize(self, reader: "easyocr.Reader", crops: List[np.ndarray]) -> List[List[Tuple]]:
+        """Read non-empty tight crops with a single call of the recognizer"""
+        # The recognizer resizes each line to its own height, larger crops only cost time
+        grays = [fit_height(img=self._to_gray(crop), max_height=config.OCR_MAX_HEIGHT) for crop in crops]
+        get_pixel_stats().record(stage="ocr", input_pixels=sum(pixels(crop) for crop in crops),
+                                 processed_pixels=sum(pixels(gray) for gray in grays))
+
+        # Stack the crops one below the other, each one has its own box
+        width = max(gray.shape[1] for gray in grays)
+        canvas = np.zeros((sum(gray.shape[0] for gray in grays), width), dtype=np.uint8)
+        boxes, rows = [], {}
+        y = 0
+        for i, gray in enumerate(grays):
+            h, w = gray.shape[:2]
+            canvas[y:y + h, :w] = gray
+            boxes.append([0, w, y, y + h])
+            rows[y] = i
+            y += h
+
+        # Every field is recognized in the same call, so they share one stage
+        with metrics.stage("ocr_recognize", crops=len(boxes)):
+            recognized = reader.recognize(canvas,
+                                          horizontal_list=boxes,
+                                          free_list=[],
+                                          batch_size=len(boxes),
+                                          detail=1)
+        results = [[] for _ in crops]
+        for box, text, conf in recognized:
+            # The first point of the box is the top left corner of the crop
+            results[rows[int(box[0][1])]].append((box, text, conf))
+        return results
+
+    @staticmethod
+    def _to_gray(img: np.ndarray) -> np.ndarray:
+        if img.ndim == 2:
+            return img
+        if img.shape[2] == 4:
+            return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    def extract(self, card: np.ndarray, elements: Dict[str, np.ndarray] = None,
+                zones: Dict[str, list] = None, entity: CreditCardData = None,
+                context: PipelineContext = None) -> CreditCardData:
+        """Extracts the card number, the cardholder and the expiry date of a card
+
+        This method does not keep any state between calls, so it can be used by
+        many requests at the same time. Each call borrows a reader from the pool.
+
+        Args:
+            card (np.ndarray): image of the credit/debit card
+            elements (Dict[str, np.ndarray], optional): crops of the card elements
+        ('card_number', 'cardholder', 'expiry_date'). The elements that are None
+        are cut from the card using the zones coords
+            zones (Dict[str, list], optional): relative coords of each zone of the card
+            entity (CreditCardData, optional): object to fill with the extracted data.
+        If it is None a new one is created
+            context (PipelineContext, optional): artifacts of the request. The regions
+        already read by a previous stage are not read again
+
+        Returns:
+            CreditCardData: the entity with the extracted data
+        """
+        return self.extract_batch(cards=[card],
+                                  elements=[elements],
+                                  zones=zones,
+                                  entities=[entity],
+                                  contexts=[context])[0]
+
+    def extract_batch(self, cards: List[np.ndarray], elements: List[Dict[str, np.ndarray]] = None,
+                      zones: Dict[str, list] = None, entities: List[CreditCardData] = None,
+                      contexts: List[PipelineContext] = None) -> List[CreditCardData]:
+        """Extracts the data of many cards reading all their crops in a single
+        OCR call
+
+        Args:
+            cards (List[np.ndarray]): images of the credit/debit cards
+            elements (List[Dict[str, np.ndarray]], optional): crops of the elements of each card
+            zones (Dict[str, list], optional): relative coords of each zone of the cards
+            entities (List[CreditCardData], optional): objects to fill for each card
+            contexts (List[PipelineContext], optional): artifacts of the request of each card
+
+        Returns:
+            List[CreditCardData]: the entities with the extracted data
+        """
+        elements = elements or [None] * len(cards)
+        entities = entities or [None] * len(cards)
+        contexts = [context if context is not None else PipelineContext(card=card)
+                    for card, context in zip(cards, contexts or [None] * len(cards))]
+
+        # Only the regions that no previous stage has read go to the OCR
+        regions = []
+        pending = {}
+        for context, card_elements in zip(contexts, elements):
+            card_regions = []
+            for attr in self.FORMATTERS.keys():
+                key, crop, tight = self._get_region(context=context, elements=card_elements or {},
+                                                    zones=zones, zone_name=attr)
+                card_regions.append(key)
+                if not context.has_ocr(key):
+                    pending[(id(context), key)] = (context, key, crop, attr, tight)
+            regions.append(card_regions)
+
+        if pending:
+            with metrics.stage("ocr", regions=len(pending)), self.readers.acquire() as reader, \
+                    registry.timed(OCR_MODEL_NAME):
+                results = self._read(reader=reader,
+                                     crops=[crop for _, _, crop, _, _ in pending.values()],
+                                     fields=[attr for _, _, _, attr, _ in pending.values()],
+                                     tight=[tight for _, _, _, _, tight in pending.values()])
+            for (context, key, _, _, _), region_results in zip(pending.values(), results):
+                context.set_ocr(key, region_results)
 
-    def extract(self, entity: CreditCardData) -> CreditCardData:
-        extractions = {
-            'card_number': (self._extract_text('card_number'), self._format_card_number),
-            'cardholder': (self._extract_text('cardholder'), self._format_card_name),
-            'expiry_date': (self._extract_text('expiry_date'), self._format_expiration_date)
-        }
-        
-        print(f"Credit card number after OCR - {extractions['card_number']}")
-        print(f"Name after OCR - {extractions['cardholder']}")
-        print(f"Expiration adte after OCR - {extractions['expiry_date']}")
+        extracted = []
+        for i, entity in enumerate(entities):
+            entity = entity if entity is not None else CreditCardData()
+            extractions = {attr: contexts[i].get_ocr(key)
+                           for attr, key in zip(self.FORMATTERS.keys(), regions[i])}
 
-        for attr, (results, formatter) in extractions.items():
-            setattr(entity, attr, self._format_text(results, formatter))
+            for attr, attr_results in extractions.items():
+                setattr(entity, attr, self._format_text(attr_results, getattr(self, self.FORMATTERS[attr])))
+            # The formatted fields, the raw OCR tuples can split a card number out of the masking.
+            # The card number is masked whatever its length, a misread one is still sensitive
+            logger.debug("Credit card number after OCR - %s - Name - %s - Expiration date - %s",
+                         mask_card_number(entity.card_number), entity.cardholder, entity.expiry_date)
 
-        entity.create_at = datetime.now()
-        return entity
+            entity.create_at = datetime.now()
+            extracted.append(entity)
+        return extracted
 
     @staticmethod
     def _format_card_number(texts: List[str]) -> str:
-        return ''.join(texts)
+        return ''.join(''.join(texts).split())
 
     @staticmethod
     def _format_card_name(texts: List[str]) -> str:
@@ -72,7 +315,8 @@ class OCRService:
     @staticmethod
     def _format_expiration_date(texts: List[str]) -> str:
         pattern = r'^[0-9/]+$'
-        return ''.join(text for text in texts if re.match(pattern, text))
+        tokens = ' '.join(texts).split()
+        return ''.join(token for token in tokens if re.match(pattern, token))
 
 def get_ocr_service():
     return OCRService()
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from src.core.pipeline_context import PipelineContext
+from typing import Callable, List, Union
+import time
+
+
+@dataclass
+class Stage:
+    """Step of a pipeline
+
+    Attributes:
+        name (str): name of the stage, used as key of its timing
+        fn (Callable[[PipelineContext], None]): function that runs the stage and
+    stores its output in the context
+        skip_if (Callable[[PipelineContext], bool], optional): the stage is skipped
+    when it returns True before the stage runs
+        stop_if (Callable[[PipelineContext], bool], optional): the pipeline stops
+    when it returns True after the stage runs
+    """
+    name: str
+    fn: Callable[[PipelineContext], None]
+    skip_if: Callable[[PipelineContext], bool] = None
+    stop_if: Callable[[PipelineContext], bool] = None
+
+
+class Pipeline:
+    """Runs a sequence of stages over the context of a request
+
+    Each item of the sequence is a Stage or a list of independent stages. The
+    stages of a list run at the same time, the first one in the calling thread and
+    the others in a thread pool, so they must not write the same attributes of the
+    context. The wall time of each stage is recorded in context.timings (in seconds).
+
+    Args:
+        stages (List[Union[Stage, List[Stage]]]): stages in the order they run
+        concurrency (int, optional): requests that run the pipeline at the same time.
+    The pool has a thread for each extra stage of a group and request, so the requests
+    don't queue behind each other. Default value is 1
+    """
+
+    def __init__(self, stages: List[Union[Stage, List[Stage]]], concurrency: int = 1):
+        self.stages = [group if isinstance(group, list) else [group] for group in stages]
+        max_workers = (max([len(group) for group in self.stages] + [1]) - 1) * max(1, concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline") \
+            if max_workers > 0 else None
+
+    @staticmethod
+    def _run_stage(stage: Stage, context: PipelineContext) -> None:
+        start = time.perf_counter()
+        stage.fn(context)
+        context.timings[stage.name] = time.perf_counter() - start
+
+    def run(self, context: PipelineContext) -> PipelineContext:
+        """Run the stages over the context
+
+        Args:
+            context (PipelineContext): context of the request with its input
+
+        Returns:
+            PipelineContext: the same context with the outputs of the stages
+        """
+        start = time.perf_counter()
+        for group in self.stages:
+            stages = [stage for stage in group if stage.skip_if is None or not stage.skip_if(context)]
+            if len(stages) == 1:
+                self._run_stage(stages[0], context)
+            elif stages:
+                futures = [self._pool.submit(self._run_stage, stage, context) for stage in stages[1:]]
+                try:
+                    self._run_stage(stages[0], context)
+                finally:
+                    for future in futures:
+                        future.result()
+            if any(stage.stop_if is not None and stage.stop_if(context) for stage in stages):
+                break
+        context.timings["total"] = time.perf_counter() - start
+        return context
@@ -0,0 +1,90 @@
+from src.utils.file_utils import extract_zone, preprocess_img
+from typing import Callable, Hashable, List
+import numpy as np
+
+
+class PipelineContext:
+    """Intermediate artifacts of a single request
+
+    The stages of a request share this object so that the preprocessed card, the
+    zones cut from it and the OCR results of each region are computed only once.
+    It also keeps the outputs of the stages of a Pipeline and their timings.
+    A context must not be shared between requests.
+    """
+
+    def __init__(self, card: np.ndarray = None, image: np.ndarray = None):
+        self.image = image
+        self.card = None
+        self.elements = None
+        # DetectionResult of the detectors: "card" and "elements"
+        self.detections = {}
+        self.payment_network = None
+        self.iin_network = None
+        self.result = None
+        self.timings = {}
+        self._gray = None
+        self._zones = {}
+        self._ocr = {}
+        if card is not None:
+            self.set_card(card)
+
+    def set_card(self, card: np.ndarray) -> None:
+        # A new card invalidates every artifact computed from the previous one
+        self.card = card
+        self.elements = None
+        self.detections.pop("elements", None)
+        self._gray = None
+        self._zones = {}
+        self._ocr = {}
+
+    @property
+    def gray(self) -> np.ndarray:
+        """Card preprocessed with preprocess_img"""
+        if self._gray is None:
+            self._gray = preprocess_img(image=self.card)
+        return self._gray
+
+    @staticmethod
+    def zone_key(zone: List[tuple]) -> tuple:
+        return ("zone",) + tuple(tuple(point) for point in zone)
+
+    @staticmethod
+    def element_key(name: str) -> tuple:
+        return ("element", name)
+
+    def zone(self, zone: List[tuple]) -> np.ndarray:
+        """Zone of the preprocessed card
+
+        Args:
+            zone (List[tuple]): relative coords in format [(x1, y1), (x2, y2)]
+
+        Returns:
+            np.ndarray: the zone cut from the preprocessed card
+        """
+        key = self.zone_key(zone)
+        if key not in self._zones:
+            self._zones[key] = extract_zone(img=self.gray, zone=zone)
+        return self._zones[key]
+
+    def has_ocr(self, key: Hashable) -> bool:
+        return key in self._ocr
+
+    def get_ocr(self, key: Hashable) -> list:
+        return self._ocr[key]
+
+    def set_ocr(self, key: Hashable, results: list) -> None:
+        self._ocr[key] = results
+
+    def ocr(self, key: Hashable, read: Callable[[], list]) -> list:
+        """OCR results of a region, the region is read only the first time
+
+        Args:
+            key (Hashable): key of the region (zone_key or element_key)
+            read (Callable[[], list]): function that reads the region
+
+        Returns:
+            list: the OCR results of the region
+        """
+        if key not in self._ocr:
+            self._ocr[key] = read()
+        return self._ocr[key]
@@ -0,0 +1,159 @@
+from src.utils.logger import get_logger
+from typing import Dict, List
+import numpy as np
+import cv2
+import hashlib
+import os
+import zipfile
+
+logger = get_logger(__name__)
+
+
+class SIFTReferenceIndex:
+    """Precomputed SIFT keypoints and descriptors of the payment network logos
+
+    The descriptors of every reference logo are stacked in a single matrix and
+    each logo is addressed by its offsets in that matrix. The index is stored on
+    disk as two files inside a directory:
+
+        - descriptors.npy: float32 matrix (N, 128) with the stacked descriptors. It
+    is memory-mapped when the index is loaded
+        - index.npz: names, offsets and keypoints (x, y, size, angle) of each logo
+    plus the fingerprint of the pattern images used to build it
+
+    The index is rebuilt when the fingerprint of the pattern images changes.
+    """
+
+    DESCRIPTORS_FILE = "descriptors.npy"
+    META_FILE = "index.npz"
+
+    def __init__(self, names: List[str], descriptors: np.ndarray, offsets: np.ndarray,
+                 keypoints: np.ndarray, fingerprint: str):
+        self.names = list(names)
+        self.descriptors = descriptors
+        self.offsets = offsets
+        self.keypoints = keypoints
+        self.fingerprint = fingerprint
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def descriptors_of(self, name: str) -> np.ndarray:
+        i = self.names.index(name)
+        return self.descriptors[self.offsets[i]:self.offsets[i + 1]]
+
+    def keypoints_of(self, name: str) -> np.ndarray:
+        i = self.names.index(name)
+        return self.keypoints[self.offsets[i]:self.offsets[i + 1]]
+
+    def items(self):
+        for i, name in enumerate(self.names):
+            yield name, self.descriptors[self.offsets[i]:self.offsets[i + 1]]
+
+    @staticmethod
+    def compute_fingerprint(patterns: Dict[str, str]) -> str:
+        """Hash of the names and the content of the pattern images
+
+        Args:
+            patterns (Dict[str, str]): name and path of each reference image
+
+        Returns:
+            str: hex digest that changes when some pattern image changes
+        """
+        digest = hashlib.sha1()
+        for name in sorted(patterns.keys()):
+            digest.update(name.encode("utf-8"))
+            with open(patterns[name], "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, patterns: Dict[str, str], preprocess: callable = None) -> "SIFTReferenceIndex":
+        """Compute the keypoints and descriptors of each pattern image
+
+        Args:
+            patterns (Dict[str, str]): name and path of each reference image
+            preprocess (callable, optional): function applied to each image before
+        computing its descriptors. Default value converts the image to gray scale
+
+        Raises:
+            FileNotFoundError: if some pattern image can not be read
+
+        Returns:
+            SIFTReferenceIndex: the index in memory
+        """
+        sift = cv2.SIFT_create()
+        names = []
+        descriptors = []
+        keypoints = []
+        offsets = [0]
+        for name, path in patterns.items():
+            image = cv2.imread(path)
+            if image is None:
+                raise FileNotFoundError(f"Pattern image not found: {path}")
+            gray = preprocess(image) if preprocess else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            kp, des = sift.detectAndCompute(gray, None)
+            if des is None:
+                des = np.empty((0, 128), dtype=np.float32)
+            names.append(name)
+            descriptors.append(des.astype(np.float32))
+            keypoints.append(np.array([[k.pt[0], k.pt[1], k.size, k.angle] for k in kp],
+                                      dtype=np.float32).reshape(-1, 4))
+            offsets.append(offsets[-1] + len(des))
+
+        return cls(names=names,
+                   descriptors=np.ascontiguousarray(np.vstack(descriptors)),
+                   offsets=np.array(offsets, dtype=np.int64),
+                   keypoints=np.vstack(keypoints),
+                   fingerprint=cls.compute_fingerprint(patterns))
+
+    def save(self, index_dir: str) -> None:
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, self.DESCRIPTORS_FILE), self.descriptors)
+        np.savez(os.path.join(index_dir, self.META_FILE),
+                 names=np.array(self.names),
+                 offsets=self.offsets,
+                 keypoints=self.keypoints,
+                 fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, index_dir: str) -> "SIFTReferenceIndex":
+        descriptors = np.load(os.path.join(index_dir, cls.DESCRIPTORS_FILE), mmap_mode="r")
+        with np.load(os.path.join(index_dir, cls.META_FILE)) as meta:
+            return cls(names=meta["names"].tolist(),
+                       descriptors=descriptors,
+                       offsets=meta["offsets"],
+                       keypoints=meta["keypoints"],
+                       fingerprint=str(meta["fingerprint"]))
+
+    @classmethod
+    def load_or_build(cls, patterns: Dict[str, str], index_dir: str,
+                      preprocess: callable = None) -> "SIFTReferenceIndex":
+        """Load the index from disk if it is up to date with the pattern images,
+        else build it again and save it
+
+        Args:
+            patterns (Dict[str, str]): name and path of each reference image
+            index_dir (str): directory where the index is stored
+            preprocess (callable, optional): function applied to each image before
+        computing its descriptors
+
+        Returns:
+            SIFTReferenceIndex: the index of the reference images
+        """
+        fingerprint = cls.compute_fingerprint(patterns)
+        try:
+            index = cls.load(index_dir)
+            if index.fingerprint == fingerprint and index.names == list(patterns.keys()):
+                return index
+            logger.info("SIFT reference index is outdated, rebuilding it in %s", index_dir)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            logger.info("SIFT reference index not found, building it in %s", index_dir)
+
+        index = cls.build(patterns=patterns, preprocess=preprocess)
+        try:
+            index.save(index_dir)
+        except OSError as e:
+            # A read-only file system only costs the index build on each start
+            logger.warning("Can't save the SIFT reference index: %s", e)
+        return index
@@ -0,0 +1,87 @@
+from typing import Dict, Tuple
+import numpy as np
+import threading
+import cv2
+
+
+class PixelStats:
+    """Pixels received and processed by each stage of the service
+
+    A stage that works on a downscaled copy of its input processes less pixels
+    than it receives. The ratio between both shows how much of the camera
+    resolution reaches the models.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage: str, input_pixels: int, processed_pixels: int) -> None:
+        with self._lock:
+            stats = self._stages.setdefault(stage, {"calls": 0, "input_pixels": 0, "processed_pixels": 0,
+                                                    "max_input_pixels": 0})
+            stats["calls"] += 1
+            stats["input_pixels"] += input_pixels
+            stats["processed_pixels"] += processed_pixels
+            stats["max_input_pixels"] = max(stats["max_input_pixels"], input_pixels)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            stats = {}
+            for stage, values in self._stages.items():
+                stats[stage] = dict(values)
+                calls = values["calls"]
+                stats[stage]["mean_input_pixels"] = values["input_pixels"] / calls
+                stats[stage]["mean_processed_pixels"] = values["processed_pixels"] / calls
+            return stats
+
+
+_pixel_stats = PixelStats()
+
+
+def get_pixel_stats() -> PixelStats:
+    return _pixel_stats
+
+
+def pixels(img: np.ndarray) -> int:
+    return img.shape[0] * img.shape[1]
+
+
+def downscale(img: np.ndarray, max_side: int, stage: str = None) -> Tuple[np.ndarray, float]:
+    """Downscale an image so that its longest side is at most max_side
+
+    Args:
+        img (np.ndarray): input image
+        max_side (int): max length of the longest side, 0 keeps the image
+        stage (str, optional): name of the stage recorded in the pixel stats
+
+    Returns:
+        Tuple[np.ndarray, float]: the image (the same object when it is not resized)
+    and the factor that maps its coords back to the input image
+    """
+    h, w = img.shape[:2]
+    small = img
+    if max_side and max(h, w) > max_side:
+        ratio = max_side / max(h, w)
+        size = (max(1, round(w * ratio)), max(1, round(h * ratio)))
+        small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    if stage is not None:
+        _pixel_stats.record(stage=stage, input_pixels=h * w, processed_pixels=pixels(small))
+    return small, w / small.shape[1] if small.shape[1] else 1.0
+
+
+def fit_height(img: np.ndarray, max_height: int) -> np.ndarray:
+    """Downscale an image keeping its aspect ratio so that its height is at most max_height
+
+    Args:
+        img (np.ndarray): input image
+        max_height (int): max height, 0 keeps the image
+
+    Returns:
+        np.ndarray: the image, the same object when it is not resized
+    """
+    h, w = img.shape[:2]
+    if not max_height or h <= max_height or w == 0:
+        return img
+    size = (max(1, round(w * max_height / h)), max_height)
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,265 @@
+from collections import OrderedDict
+from dataclasses import asdict
+from datetime import datetime
+from src.config.config import Config
+from src.core import gd_inference
+from src.models.model import CreditCardData
+from src.utils.logger import get_logger
+import copy
+import hashlib
+import json
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+
+config = Config()
+logger = get_logger(__name__)
+
+# Settings that change the result of a request, they are part of the cache key
+VERSION_SETTINGS = [
+    "YOLO_BACKEND", "YOLO_PRECISION", "DETECTION_CONF", "DETECTION_IOU", "DETECTION_AGNOSTIC_NMS",
+    "DETECT_MAX_SIDE", "ELEMENTS_MAX_SIDE", "OCR_MODE", "OCR_MAX_HEIGHT", "OCR_QUANTIZE",
+    "PIPELINE_MODE", "SIFT_MATCHER_MODE", "IIN_RANGES_PATH", "IIN_REMOTE_LOOKUP",
+]
+# Weights of the models, a new version of a file invalidates the cached results
+VERSION_FILES = ["YOLO_CARD_DETECTOR", "YOLO_CARD_ELEMENT_DETECTOR", "YOLO_PAYMENT_NETWORK_CLASSIFIER"]
+# Files of the models that are not set from the environment (GroundingDINO detects the cards of v1)
+VERSION_PATHS = {
+    "GROUNDING_DINO_CONFIG": gd_inference.MODEL_CONFIG_PATH,
+    "GROUNDING_DINO_WEIGHTS": gd_inference.WEIGHTS_PATH,
+}
+
+
+def models_version() -> str:
+    """Hash of the settings and the weights (path, size and mtime) that produce the results"""
+    parts = [f"{name}={getattr(config, name, None)}" for name in VERSION_SETTINGS]
+    paths = {**{name: os.getenv(name) or "" for name in VERSION_FILES}, **VERSION_PATHS}
+    for name, path in paths.items():
+        try:
+            stat = os.stat(path)
+            parts.append(f"{name}={path}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{name}={path}")
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """Cache of the results of the pipelines, keyed by the content of the image
+
+    The key is a blake2b hash of the decoded pixels, the name of the pipeline and
+    the version of the models and settings, so a retry of the same scan returns
+    the previous result without running the models. The results live in:
+        1. In-memory LRU with TTL (RESULT_CACHE_SIZE entries)
+        2. Optional SQLite store (RESULT_CACHE_DB), encrypted with Fernet using
+    RESULT_CACHE_KEY. Card data is never written to disk in plain text
+
+    Every entry expires after RESULT_CACHE_TTL seconds, the expired entries are
+    removed from both levels, so no card data is kept longer than the policy allows.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(ResultCache, cls).__new__(cls)
+                    instance._init()
+                    cls._instance = instance
+        return cls._instance
+
+    def _init(self) -> None:
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._last_purge = 0.0
+        self._db_lock = threading.Lock()
+        self._version = models_version()
+        self._fernet = None
+        self._db = None
+        if config.RESULT_CACHE_DB:
+            self._fernet = self._open_fernet(config.RESULT_CACHE_KEY)
+            self._db = self._open_db(config.RESULT_CACHE_DB)
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    @staticmethod
+    def _open_fernet(key: str):
+        if not key:
+            raise EnvironmentError("RESULT_CACHE_KEY is required to store the results on disk")
+        # Optional dependency, only needed by the disk store
+        from cryptography.fernet import Fernet
+        return Fernet(key.encode())
+
+    @staticmethod
+    def _open_db(path: str):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, timeout=1.0)
+            db.execute("CREATE TABLE IF NOT EXISTS result_cache "
+                       "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS result_cache_expires_at ON result_cache (expires_at)")
+            # The results of the previous runs that already expired are removed now
+            db.execute("DELETE FROM result_cache WHERE expires_at < ?", (time.time(),))
+            db.commit()
+            return db
+        except sqlite3.Error as e:
+            logger.warning("Can't open the result cache database %s: %s", path, e)
+            return None
+
+    @property
+    def enabled(self) -> bool:
+        return config.RESULT_CACHE_SIZE > 0
+
+    def key(self, img: np.ndarray, namespace: str) -> str:
+        """Key of the result of an image
+
+        Args:
+            img (np.ndarray): decoded image
+            namespace (str): pipeline and parameters of the request ("v1", "v2", "v2_batch")
+
+        Returns:
+            str: hex digest of the pixels, the shape, the namespace and the models version
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{self._version}|{namespace}|{img.shape}|{img.dtype}|".encode())
+        # hashlib reads the buffer of the array without copying it
+        digest.update(memoryview(np.ascontiguousarray(img)).cast("B"))
+        return digest.hexdigest()
+
+    def _count(self, key: str) -> None:
+        with self._memory_lock:
+            self._stats[key] += 1
+
+    def _get_memory(self, key: str):
+        with self._memory_lock:
+            item = self._memory.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                del self._memory[key]
+                self._stats["expirations"] += 1
+                return None
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return item[0]
+
+    def _purge_memory(self, now: float) -> None:
+        # Called with the memory lock. The expired results are removed even if
+        # they are never requested again, at most once per second
+        if now - self._last_purge < 1.0:
+            return
+        self._last_purge = now
+        expired = [key for key, (_, expires_at) in self._memory.items() if expires_at < now]
+        for key in expired:
+            del self._memory[key]
+        self._stats["expirations"] += len(expired)
+
+    def _set_memory(self, key: str, result: CreditCardData, expires_at: float) -> None:
+        with self._memory_lock:
+            self._purge_memory(now=time.time())
+            self._memory[key] = (result, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > config.RESULT_CACHE_SIZE:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    @staticmethod
+    def _serialize(result: CreditCardData) -> bytes:
+        data = asdict(result)
+        if result.create_at:
+            data["create_at"] = result.create_at.isoformat()
+        return json.dumps(data).encode()
+
+    @staticmethod
+    def _deserialize(value: bytes) -> CreditCardData:
+        data = json.loads(value)
+        if data.get("create_at"):
+            data["create_at"] = datetime.fromisoformat(data["create_at"])
+        return CreditCardData(**data)
+
+    def _get_disk(self, key: str):
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT value, expires_at FROM result_cache WHERE key = ?",
+                                       (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        try:
+            result = self._deserialize(self._fernet.decrypt(row[0]))
+        except Exception as e:
+            logger.warning("Can't read the cached result %s: %s", key, e)
+            return None
+        self._count("disk_hits")
+        self._set_memory(key, result, row[1])
+        return result
+
+    def _set_disk(self, key: str, result: CreditCardData, expires_at: float) -> None:
+        if self._db is None:
+            return
+        try:
+            value = self._fernet.encrypt(self._serialize(result))
+            with self._db_lock:
+                now = time.time()
+                self._db.execute("INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                                 (key, value, expires_at))
+                self._db.execute("DELETE FROM result_cache WHERE expires_at < ?", (now,))
+                # Bound the store, the entries closer to expire are removed first
+                self._db.execute("DELETE FROM result_cache WHERE key IN (SELECT key FROM result_cache "
+                                 "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (config.RESULT_CACHE_DISK_SIZE,))
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Can't save the result %s in the cache: %s", key, e)
+
+    def get(self, key: str):
+        """Cached result of a key
+
+        Args:
+            key (str): key built with ResultCache.key
+
+        Returns:
+            CreditCardData | None: a copy of the cached result, None if it is not cached
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        result = self._get_memory(key)
+        if result is None:
+            result = self._get_disk(key)
+        if result is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        result = copy.deepcopy(result)
+        result.timings = {"cache": time.perf_counter() - start}
+        return result
+
+    def put(self, key: str, result: CreditCardData) -> None:
+        """Cache the result of a key for RESULT_CACHE_TTL seconds"""
+        if not self.enabled:
+            return
+        expires_at = time.time() + config.RESULT_CACHE_TTL
+        result = copy.deepcopy(result)
+        self._set_memory(key, result, expires_at)
+        self._set_disk(key, result, expires_at)
+
+    def stats(self) -> dict:
+        with self._memory_lock:
+            return {"enabled": self.enabled, "memory_size": len(self._memory), "disk": self._db is not None,
+                    **self._stats}
+
+
+def get_result_cache():
+    return ResultCache()
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, asdict
 from datetime import datetime
+import numpy as np
 
 @dataclass
 class CreditCardData:
@@ -9,9 +10,62 @@ class CreditCardData:
     expiry_date: datetime = None
     create_at: datetime = None
     obs: str = None
+    timings: dict = None
+    confidences: dict = None
     
     def to_dict(self):
         data = asdict(self)
         if self.create_at:
             data['create_at'] = self.create_at.isoformat()
-        return data
\ No newline at end of file
+        return data
+
+
+@dataclass
+class DetectionResult:
+    """Boxes detected in an image, as compact numpy arrays
+
+    The boxes are sorted by confidence in descending order, so the first box of a
+    class is the most confident one.
+
+    Attributes:
+        xyxy (np.ndarray): int32 boxes of shape (N, 4) in pixels of the image
+        cls (np.ndarray): int32 class of each box, shape (N,)
+        conf (np.ndarray): float32 confidence of each box, shape (N,)
+    """
+    xyxy: np.ndarray
+    cls: np.ndarray
+    conf: np.ndarray
+
+    @classmethod
+    def from_boxes(cls, boxes, scale: float = 1.0) -> "DetectionResult":
+        """Build the result from the boxes of an Ultralytics result
+
+        Args:
+            boxes (Boxes): boxes of an Ultralytics result
+            scale (float, optional): factor applied to the coords, it maps the boxes
+        found in a downscaled image back to the original image. Default value is 1.0
+        """
+        data = boxes.data.cpu().numpy() if len(boxes) else np.empty((0, 6), dtype=np.float32)
+        order = np.argsort(-data[:, 4], kind="stable")
+        data = data[order]
+        return cls(xyxy=(data[:, :4] * scale).astype(np.int32),
+                   cls=data[:, 5].astype(np.int32),
+                   conf=data[:, 4].astype(np.float32))
+
+    def __len__(self) -> int:
+        return len(self.cls)
+
+    def first(self, class_id: int) -> int:
+        """Index of the most confident box of a class, None if the class was not detected"""
+        indices = np.flatnonzero(self.cls == class_id)
+        return int(indices[0]) if len(indices) else None
+
+    def box(self, class_id: int) -> np.ndarray:
+        """Most confident box of a class, None if the class was not detected"""
+        index = self.first(class_id)
+        return self.xyxy[index] if index is not None else None
+
+    def confidence(self, class_id: int) -> float:
+        """Confidence of the most confident box of a class, None if the class was not detected"""
+        index = self.first(class_id)
+        return float(self.conf[index]) if index is not None else None
@@ -0,0 +1,115 @@
+"""Compare the outputs of an inference backend against the PyTorch backend
+
+For each image the three YOLO models run with both backends, PyTorch at fp32 and
+the candidate at the precision of YOLO_PRECISION. The detectors must find the same
+number of boxes, with the same classes and an IoU over the given threshold, and the
+classifier must give the same top1 class.
+
+The check is manual, it is not part of an automated suite: it needs the weights
+and onnxruntime or openvino. Run it after changing the backend, the precision or
+the weights; the exit code is 1 when an image differs.
+
+Usage (from the project root):
+    python -m src.tools.backend_parity --backend onnx --images data/input_data
+"""
+from src.core.inference_backend import load_yolo
+from dotenv import load_dotenv
+from pathlib import Path
+import numpy as np
+import argparse
+import cv2
+import os
+import sys
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+MODELS = {
+    "card_detector": ("YOLO_CARD_DETECTOR", "detect"),
+    "elements_detector": ("YOLO_CARD_ELEMENT_DETECTOR", "detect"),
+    "classifier": ("YOLO_PAYMENT_NETWORK_CLASSIFIER", "classify"),
+}
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU matrix between two sets of boxes in xyxy format"""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def same_detections(reference, other, iou_threshold: float) -> bool:
+    ref_boxes, ref_cls = reference.boxes.xyxy.cpu().numpy(), reference.boxes.cls.cpu().numpy()
+    boxes, cls = other.boxes.xyxy.cpu().numpy(), other.boxes.cls.cpu().numpy()
+    if len(ref_boxes) != len(boxes):
+        return False
+    if len(ref_boxes) == 0:
+        return True
+    iou = box_iou(ref_boxes, boxes)
+    # Each reference box must match a box of the same class
+    iou[ref_cls[:, None] != cls[None, :]] = 0.0
+    matched = set()
+    for i in np.argsort(-iou.max(axis=1)):
+        candidates = [j for j in np.argsort(-iou[i]) if j not in matched and iou[i, j] >= iou_threshold]
+        if not candidates:
+            return False
+        matched.add(candidates[0])
+    return True
+
+
+def same_classification(reference, other) -> bool:
+    return reference.probs.top1 == other.probs.top1
+
+
+def list_images(paths: list) -> list:
+    images = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            images.extend(sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES))
+        else:
+            images.append(path)
+    return images
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", required=True, choices=["onnx", "openvino"])
+    parser.add_argument("--images", required=True, nargs="+", help="images or directories of images")
+    parser.add_argument("--iou", type=float, default=0.9, help="min IoU between matched boxes")
+    parser.add_argument("--env", default=".env", help="file with the paths of the weights")
+    args = parser.parse_args()
+
+    load_dotenv(args.env)
+    images = [(path, cv2.imread(str(path))) for path in list_images(args.images)]
+    images = [(path, img) for path, img in images if img is not None]
+    if not images:
+        print("No images found")
+        return 1
+
+    failures = 0
+    for name, (env_var, task) in MODELS.items():
+        weights = os.getenv(env_var)
+        # The reference is always the full precision model, so a fp16 or int8 candidate
+        # is compared against it and not against another quantized model
+        reference = load_yolo(weights=weights, task=task, backend="torch", precision="fp32")
+        candidate = load_yolo(weights=weights, task=task, backend=args.backend)
+        mismatches = []
+        for path, img in images:
+            ref_result = reference(source=img, verbose=False)[0]
+            result = candidate(source=img, verbose=False)[0]
+            same = same_classification(ref_result, result) if task == "classify" \
+                else same_detections(ref_result, result, iou_threshold=args.iou)
+            if not same:
+                mismatches.append(path.name)
+        failures += len(mismatches)
+        print(f"{name}: {len(images) - len(mismatches)}/{len(images)} images match")
+        for image_name in mismatches:
+            print(f"    mismatch: {image_name}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""Benchmark of the models and pipelines of the service over a labeled corpus
+
+It measures the load time of each model, the latency (p50/p95/p99) of each
+stage (CardService, OCRService, credit_card_detector and identify_by_SIFT),
+the throughput of the v2 pipeline at several concurrency levels and the peak
+RSS of the process. The report is a JSON file, so runs of different commits
+can be compared. The corpus can be rendered with src.tools.synthetic_cards.
+
+Usage (from src/api, like the service):
+    python -m src.tools.synthetic_cards --count 40 --output ../../data/benchmark
+    python -m src.tools.benchmark --labels ../../data/benchmark/labels.json \\
+        --stages card_service ocr sift v1 --concurrency 1 2 4 8 --output benchmark.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+STAGES = ["card_service", "ocr", "sift", "v1"]
+
+# Settings saved in the report, they explain the differences between runs
+REPORT_SETTINGS = [
+    "DEVICE", "YOLO_BACKEND", "YOLO_PRECISION", "OCR_MODE", "OCR_READER_POOL_SIZE", "OCR_QUANTIZE",
+    "PIPELINE_MODE", "CARD_BATCH_MAX_SIZE", "SIFT_MATCHER_MODE", "DETECT_MAX_SIDE", "ELEMENTS_MAX_SIDE",
+    "OCR_MAX_HEIGHT",
+]
+
+
+def summarize(values: list) -> dict:
+    """Latency percentiles in milliseconds"""
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values) * 1000
+    return {"count": len(values),
+            "mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)),
+            "p99": float(np.percentile(values, 99))}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Timer:
+    """Collects the wall time of each call of each stage"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def __call__(self, stage: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def report(self) -> dict:
+        return {stage: summarize(values) for stage, values in self.samples.items()}
+
+
+def load_corpus(labels_path: str) -> list:
+    import cv2
+
+    labels_path = Path(labels_path)
+    with open(labels_path) as file:
+        labels = json.load(file)
+    corpus = []
+    for label in labels:
+        img = cv2.imread(str(labels_path.parent / label["image"]))
+        if img is None:
+            print(f"Image not found: {label['image']}")
+            continue
+        corpus.append((label, img))
+    return corpus
+
+
+def load_models(stages: list) -> dict:
+    """Load the models used by the stages and return the load time of each one"""
+    from src.core.card_service import MODEL_TASKS
+    from src.core.credit_card_processor import SIFT_MATCHER_NAME
+    from src.core.gd_inference import MODEL_NAME as GROUNDING_DINO_NAME
+    from src.core.model_registry import get_model_registry
+    from src.core.ocr_service import OCR_MODEL_NAME
+
+    names = []
+    if "card_service" in stages or "ocr" in stages:
+        names.extend(MODEL_TASKS)
+    if "ocr" in stages or "v1" in stages:
+        names.append(OCR_MODEL_NAME)
+    if "sift" in stages or "v1" in stages:
+        names.append(SIFT_MATCHER_NAME)
+    if "v1" in stages:
+        names.append(GROUNDING_DINO_NAME)
+
+    registry = get_model_registry()
+    registry.warmup(names)
+    models = registry.stats()["models"]
+    return {name: models[name]["load_time_s"] for name in names}
+
+
+def run_stages(corpus: list, stages: list, warmup: int) -> dict:
+    """Run each stage over every image of the corpus, one image at a time"""
+    from src.config.config import Config
+    from src.core.card_service import get_card_service
+    from src.core.credit_card_processor import credit_card_detector, identify_by_SIFT
+    from src.core.ocr_service import get_ocr_service
+    from src.utils.file_utils import crop_image
+
+    config = Config()
+    card_service = get_card_service()
+    ocr_service = get_ocr_service()
+
+    def run(timer: Timer, label: dict, img: np.ndarray) -> None:
+        card = None
+        elements = None
+        if "card_service" in stages or "ocr" in stages:
+            detection = timer("card_service.detect_card", card_service.detect_card, input_img=img)
+            card = card_service.crop_card(input_img=img, detection=detection)
+            if card is not None:
+                elements = timer("card_service.detect_elements", card_service.get_card_elements, card=card)
+                if "card_service" in stages:
+                    timer("card_service.classify_network", card_service.classify_payment_network,
+                          element=elements["payment_network"], card=card)
+        if "ocr" in stages and card is not None:
+            timer("ocr.extract", ocr_service.extract, card=card, elements=elements,
+                  zones=config.COMMON_CARD_ZONES)
+        if "sift" in stages:
+            # The labeled box isolates SIFT from the errors of the card detector
+            box = label.get("card_box")
+            sift_card = crop_image(img=img, bbox=box) if box else card
+            if sift_card is not None:
+                timer("sift.identify_by_SIFT", identify_by_SIFT, credit_card=sift_card)
+        if "v1" in stages:
+            timer("v1.credit_card_detector", credit_card_detector, img=img)
+
+    # The first calls initialize caches and kernels, they are not measured
+    for label, img in corpus[:warmup]:
+        run(Timer(), label, img)
+    timer = Timer()
+    for label, img in corpus:
+        run(timer, label, img)
+    return timer.report()
+
+
+def run_concurrency(corpus: list, levels: list, rounds: int) -> dict:
+    """Throughput and latency of the v2 pipeline with concurrent requests"""
+    from src.core.card_pipeline import process_image
+
+    imgs = [img for _, img in corpus] * rounds
+    results = {}
+    for level in levels:
+        latencies = []
+
+        def request(img: np.ndarray) -> None:
+            start = time.perf_counter()
+            process_image(img=img)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            list(pool.map(request, imgs))
+        elapsed = time.perf_counter() - start
+        results[str(level)] = {"throughput_img_s": len(imgs) / elapsed, "latency_ms": summarize(latencies)}
+        print(f"Concurrency {level}: {len(imgs) / elapsed:.2f} img/s")
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", required=True, help="labels file of the corpus")
+    parser.add_argument("--stages", nargs="+", default=["card_service", "ocr", "sift"], choices=STAGES)
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 2, 4],
+                        help="concurrency levels of the v2 pipeline, empty skips the throughput test")
+    parser.add_argument("--rounds", type=int, default=1, help="passes over the corpus per concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="images processed before the measures")
+    parser.add_argument("--remote-iin", action="store_true", help="allow the BINLIST lookups of v1")
+    parser.add_argument("--output", default=None, help="JSON file where the report is saved")
+    args = parser.parse_args()
+
+    # The network calls would measure BINLIST instead of the service
+    if not args.remote_iin:
+        os.environ["IIN_REMOTE_LOOKUP"] = "false"
+    from src.config.config import Config
+
+    config = Config()
+    corpus = load_corpus(args.labels)
+    if not corpus:
+        print("No images found")
+        return 1
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "images": len(corpus),
+            "settings": {name: getattr(config, name, None) for name in REPORT_SETTINGS},
+        },
+    }
+    start = time.perf_counter()
+    report["load_s"] = load_models(stages=args.stages)
+    report["load_total_s"] = time.perf_counter() - start
+    report["rss_after_load_mb"] = peak_rss_mb()
+    report["stages_ms"] = run_stages(corpus=corpus, stages=args.stages, warmup=args.warmup)
+    if args.concurrency:
+        report["concurrency"] = run_concurrency(corpus=corpus, levels=args.concurrency, rounds=args.rounds)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    for stage, stats in report["stages_ms"].items():
+        print(f"{stage:<32} p50 {stats['p50']:8.1f} ms  p95 {stats['p95']:8.1f} ms  p99 {stats['p99']:8.1f} ms")
+    print(f"Models loaded in {report['load_total_s']:.1f}s - peak RSS {report['peak_rss_mb']:.0f} MB")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
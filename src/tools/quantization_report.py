@@ -0,0 +1,221 @@
+"""Latency, memory and accuracy of the precision variants of the models
+
+Each variant (backend:precision of the YOLO models, and the quantization of the
+EasyOCR recognizer) runs the v2 pipeline over labeled images in its own process,
+so the memory of a variant does not include the models of the others. Every
+model runs for every image: the classifier is not skipped by the IIN of the
+card number, so the network accuracy is the accuracy of the classifier.
+
+The labels file is a JSON list, the image paths are relative to the file:
+    [{"image": "visa_1.jpg", "card_number": "4111 1111 1111 1111", "payment_network": "VISA"}]
+
+Usage (from the directory where the service runs, so the relative paths of the
+settings resolve the same way):
+    python -m src.tools.quantization_report --labels labels.json \\
+        --variants torch:fp32 onnx:fp32 onnx:int8 openvino:int8 --ocr-precision fp32 int8 \\
+        --min-card-number-accuracy 0.95 --min-network-accuracy 0.98 --output report.json
+"""
+from pathlib import Path
+import numpy as np
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODELS = {
+    "YOLO_CARD_DETECTOR": "detect",
+    "YOLO_CARD_ELEMENT_DETECTOR": "detect",
+    "YOLO_PAYMENT_NETWORK_CLASSIFIER": "classify",
+}
+
+
+def load_labels(path: str) -> list:
+    labels_path = Path(path)
+    with open(labels_path) as file:
+        labels = json.load(file)
+    for label in labels:
+        label["image"] = str(labels_path.parent / label["image"])
+    return labels
+
+
+def digits(text: str) -> str:
+    return "".join(char for char in str(text or "") if char.isdigit())
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"mean": None, "p50": None, "p95": None}
+    values = np.asarray(values) * 1000
+    return {"mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95))}
+
+
+def model_size(path: str) -> int:
+    path = Path(path)
+    if path.is_dir():
+        return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def run_variant(labels: list, warmup: int) -> dict:
+    """Run the pipeline of the variant set in the environment over the labeled images"""
+    # Imported here, so the settings of the variant are read from the environment
+    from src.config.config import Config
+    from src.core.card_pipeline import classify_network, detect_card, detect_elements, ocr_fields
+    from src.core.card_service import MODEL_TASKS
+    from src.core.inference_backend import export_model
+    from src.core.model_registry import get_model_registry
+    from src.core.ocr_service import OCR_MODEL_NAME
+    from src.core.pipeline import Pipeline, Stage
+    from src.core.pipeline_context import PipelineContext
+    from src.models.model import CreditCardData
+    import cv2
+    import resource
+
+    config = Config()
+    # The exports are done before the timer, they are done once per variant
+    sizes = {}
+    for env_var, task in MODELS.items():
+        path = export_model(weights=os.getenv(env_var), backend=config.YOLO_BACKEND,
+                            precision=config.YOLO_PRECISION, task=task)
+        sizes[env_var] = model_size(path)
+
+    start = time.perf_counter()
+    get_model_registry().warmup([*MODEL_TASKS, OCR_MODEL_NAME])
+    load_s = time.perf_counter() - start
+
+    pipeline = Pipeline(stages=[
+        Stage(name="detect_card", fn=detect_card, stop_if=lambda context: context.card is None),
+        Stage(name="detect_elements", fn=detect_elements),
+        Stage(name="ocr_fields", fn=ocr_fields),
+        Stage(name="classify_network", fn=classify_network),
+    ])
+
+    def process(img: np.ndarray) -> PipelineContext:
+        context = PipelineContext(image=img)
+        context.result = CreditCardData()
+        return pipeline.run(context=context)
+
+    images = [(label, cv2.imread(label["image"])) for label in labels]
+    missing = [label["image"] for label, img in images if img is None]
+    images = [(label, img) for label, img in images if img is not None]
+    for _, img in images[:warmup]:
+        process(img)
+
+    timings = {}
+    detected = card_number_ok = card_number_total = network_ok = network_total = 0
+    for label, img in images:
+        context = process(img)
+        for stage, elapsed in context.timings.items():
+            timings.setdefault(stage, []).append(elapsed)
+        detected += context.card is not None
+        if label.get("card_number"):
+            card_number_total += 1
+            card_number_ok += digits(context.result.card_number) == digits(label["card_number"])
+        if label.get("payment_network"):
+            network_total += 1
+            network_ok += str(context.payment_network or "").upper() == label["payment_network"].upper()
+
+    total = timings.get("total", [])
+    return {
+        "images": len(images),
+        "missing_images": missing,
+        "load_s": load_s,
+        "latency_ms": percentiles(total),
+        "stages_ms": {stage: percentiles(values) for stage, values in timings.items() if stage != "total"},
+        "throughput_img_s": len(total) / sum(total) if total else None,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "model_size_mb": {name: size / 2 ** 20 for name, size in sizes.items()},
+        "card_detection_rate": detected / len(images) if images else None,
+        "card_number_accuracy": card_number_ok / card_number_total if card_number_total else None,
+        "network_accuracy": network_ok / network_total if network_total else None,
+    }
+
+
+def spawn_variant(args: argparse.Namespace, variant: str, ocr_precision: str) -> dict:
+    backend, precision = variant.split(":")
+    env = dict(os.environ, YOLO_BACKEND=backend, YOLO_PRECISION=precision,
+               OCR_QUANTIZE=str(ocr_precision == "int8").lower())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_file = os.path.join(tmp_dir, "result.json")
+        command = [sys.executable, "-m", "src.tools.quantization_report", "--labels", args.labels,
+                   "--warmup", str(args.warmup), "--worker", result_file]
+        process = subprocess.run(command, env=env)
+        if process.returncode != 0 or not os.path.exists(result_file):
+            return {"error": f"exit code {process.returncode}"}
+        with open(result_file) as file:
+            return json.load(file)
+
+
+def meets_bar(result: dict, args: argparse.Namespace) -> bool:
+    for key, minimum in (("card_number_accuracy", args.min_card_number_accuracy),
+                         ("network_accuracy", args.min_network_accuracy)):
+        if minimum is not None and (result.get(key) is None or result[key] < minimum):
+            return False
+    return "error" not in result
+
+
+def print_report(report: dict) -> None:
+    header = f"{'variant':<28}{'p50 ms':>9}{'p95 ms':>9}{'load s':>8}{'RSS MB':>9}{'card #':>8}{'network':>9}"
+    print(header)
+    print("-" * len(header))
+
+    def fmt(value, pattern):
+        return format(value, pattern) if value is not None else "-"
+
+    for name, result in report["variants"].items():
+        if "error" in result:
+            print(f"{name:<28}failed: {result['error']}")
+            continue
+        print(f"{name:<28}{fmt(result['latency_ms']['p50'], '9.1f')}{fmt(result['latency_ms']['p95'], '9.1f')}"
+              f"{fmt(result['load_s'], '8.1f')}{fmt(result['peak_rss_mb'], '9.0f')}"
+              f"{fmt(result['card_number_accuracy'], '8.3f')}{fmt(result['network_accuracy'], '9.3f')}")
+    print(f"Fastest variant that meets the accuracy bar: {report['selected'] or 'none'}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", required=True, help="JSON file with the labeled images")
+    parser.add_argument("--variants", nargs="+", default=["torch:fp32", "onnx:fp32", "onnx:int8"],
+                        help="backend:precision of the YOLO models")
+    parser.add_argument("--ocr-precision", nargs="+", default=["int8"], choices=["fp32", "int8"],
+                        help="precision of the EasyOCR recognizer")
+    parser.add_argument("--warmup", type=int, default=2, help="images processed before the measures")
+    parser.add_argument("--min-card-number-accuracy", type=float, default=None)
+    parser.add_argument("--min-network-accuracy", type=float, default=None)
+    parser.add_argument("--output", default=None, help="JSON file where the report is saved")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    if args.worker:
+        result = run_variant(labels=labels, warmup=args.warmup)
+        with open(args.worker, "w") as file:
+            json.dump(result, file)
+        return 0
+
+    report = {"labels": args.labels, "variants": {}}
+    for variant in args.variants:
+        for ocr_precision in args.ocr_precision:
+            name = f"{variant} ocr:{ocr_precision}"
+            print(f"Running {name}")
+            report["variants"][name] = spawn_variant(args=args, variant=variant, ocr_precision=ocr_precision)
+
+    candidates = [(result["latency_ms"]["p50"], name) for name, result in report["variants"].items()
+                  if meets_bar(result, args) and result["latency_ms"]["p50"] is not None]
+    report["selected"] = min(candidates)[1] if candidates else None
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0 if report["selected"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
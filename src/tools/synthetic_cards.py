@@ -0,0 +1,162 @@
+"""Render a corpus of synthetic card photos from the logos of data/patterns
+
+Each card has a random background, a Luhn-valid card number with an IIN of its
+payment network, a cardholder, an expiry date and the logo of the network in
+the payment network zone. The card is pasted on a larger "photo" with a random
+position, so the card detector has something to find. The labels are written
+in the format of src.tools.quantization_report and src.tools.benchmark.
+
+Usage (from src/api, like the service):
+    python -m src.tools.synthetic_cards --count 50 --output ../../data/benchmark
+"""
+from src.config.config import Config
+from pathlib import Path
+import numpy as np
+import argparse
+import json
+import cv2
+import sys
+
+config = Config()
+
+# Card size in pixels with the ISO/IEC 7810 ID-1 ratio
+CARD_SIZE = (856, 540)
+
+# Logo, IIN prefixes and length of the number of each network
+NETWORKS = {
+    config.VISA_CONSTANT: ("visa", ["4"], 16),
+    config.MASTERCARD_CONSTANT: ("mastercard", ["51", "52", "53", "54", "55"], 16),
+    config.AMERCIAN_EXPRESS_CONSTANT: ("american_express", ["34", "37"], 15),
+    config.CABAL_CONSTANT: ("cabal", ["589657", "604201"], 16),
+}
+
+FIRST_NAMES = ["JUAN", "MARIA", "CARLOS", "ANA", "LUCIA", "PEDRO", "SOFIA", "DIEGO"]
+LAST_NAMES = ["GOMEZ", "PEREZ", "RODRIGUEZ", "FERNANDEZ", "LOPEZ", "MARTINEZ", "GARCIA"]
+
+
+def luhn_complete(prefix: str, length: int, rng: np.random.Generator) -> str:
+    """Random card number with the prefix and a valid Luhn check digit"""
+    digits = prefix + "".join(str(d) for d in rng.integers(0, 10, size=length - len(prefix) - 1))
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        # The check digit is appended, so the doubled digits are the even positions from the right
+        if i % 2 == 0:
+            value = value * 2 - 9 if value > 4 else value * 2
+        total += value
+    return digits + str((10 - total % 10) % 10)
+
+
+def format_number(number: str) -> str:
+    if len(number) == 15:
+        return f"{number[:4]} {number[4:10]} {number[10:]}"
+    return " ".join(number[i:i + 4] for i in range(0, len(number), 4))
+
+
+def zone_rect(zone: list) -> tuple:
+    (x1, y1), (x2, y2) = zone
+    w, h = CARD_SIZE
+    return int(x1 * w), int(y1 * h), min(int(x2 * w), w), min(int(y2 * h), h)
+
+
+def put_text(img: np.ndarray, text: str, zone: list, scale: float, color: tuple) -> None:
+    """Write the text vertically centered in a zone of the card"""
+    x1, y1, _, y2 = zone_rect(zone)
+    (_, text_h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_DUPLEX, scale, 2)
+    y = y1 + (y2 - y1 + text_h) // 2
+    cv2.putText(img, text, (x1 + 40, y), cv2.FONT_HERSHEY_DUPLEX, scale, color, 2, cv2.LINE_AA)
+
+
+def render_card(network: str, logos: dict, rng: np.random.Generator) -> tuple:
+    """Render a card of the network
+
+    Returns:
+        tuple: the card image (BGR) and its labels
+    """
+    logo_name, prefixes, length = NETWORKS[network]
+    w, h = CARD_SIZE
+    # Background gradient between two random colors
+    start, end = rng.integers(20, 236, size=(2, 3))
+    ramp = np.linspace(0.0, 1.0, w)[None, :, None]
+    card = (start * (1 - ramp) + end * ramp).astype(np.uint8).repeat(h, axis=0)
+    text_color = (255, 255, 255) if card.mean() < 128 else (20, 20, 20)
+
+    number = luhn_complete(prefix=str(rng.choice(prefixes)), length=length, rng=rng)
+    holder = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    expiry = f"{rng.integers(1, 13):02d}/{rng.integers(25, 35)}"
+    put_text(card, format_number(number), config.COMMON_CARD_ZONES["card_number"], 1.6, text_color)
+    put_text(card, holder, config.COMMON_CARD_ZONES["cardholder"], 1.0, text_color)
+    put_text(card, expiry, config.COMMON_CARD_ZONES["expiry_date"], 1.0, text_color)
+
+    # Logo in the payment network zone, keeping its aspect ratio
+    logo = logos[logo_name]
+    x1, y1, x2, y2 = zone_rect(config.COMMON_CARD_ZONES["payment_network"])
+    ratio = min((x2 - x1) * 0.8 / logo.shape[1], (y2 - y1) * 0.8 / logo.shape[0])
+    logo = cv2.resize(logo, (max(1, int(logo.shape[1] * ratio)), max(1, int(logo.shape[0] * ratio))),
+                      interpolation=cv2.INTER_AREA)
+    lx, ly = x2 - logo.shape[1] - 20, y2 - logo.shape[0] - 20
+    card[ly:ly + logo.shape[0], lx:lx + logo.shape[1]] = logo
+
+    labels = {"card_number": number, "payment_network": network, "cardholder": holder, "expiry_date": expiry}
+    return card, labels
+
+
+def render_photo(card: np.ndarray, photo_size: tuple, rng: np.random.Generator) -> tuple:
+    """Paste the card on a noisy background at a random position and scale
+
+    Returns:
+        tuple: the photo and the box of the card in it (x1, y1, x2, y2)
+    """
+    pw, ph = photo_size
+    scale = rng.uniform(0.45, 0.8) * pw / card.shape[1]
+    card = cv2.resize(card, (int(card.shape[1] * scale), int(card.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    photo = rng.integers(60, 200, size=(ph, pw, 3), dtype=np.uint8)
+    photo = cv2.GaussianBlur(photo, (0, 0), 8)
+    x = int(rng.integers(0, pw - card.shape[1]))
+    y = int(rng.integers(0, ph - card.shape[0]))
+    photo[y:y + card.shape[0], x:x + card.shape[1]] = card
+    return photo, [x, y, x + card.shape[1], y + card.shape[0]]
+
+
+def generate(count: int, output: str, photo_size: tuple = (1920, 1440), seed: int = 0) -> str:
+    """Render the corpus and write its labels
+
+    Returns:
+        str: path of the labels file
+    """
+    rng = np.random.default_rng(seed)
+    logos = {name: cv2.imread(path) for name, path in config.PATTERNS_DICT.items()}
+    missing = [name for name, logo in logos.items() if logo is None]
+    if missing:
+        raise FileNotFoundError(f"Logos not found: {missing}, run it from src/api")
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    networks = list(NETWORKS.keys())
+    labels = []
+    for i in range(count):
+        card, label = render_card(network=networks[i % len(networks)], logos=logos, rng=rng)
+        photo, box = render_photo(card=card, photo_size=photo_size, rng=rng)
+        name = f"card_{i:04d}.jpg"
+        cv2.imwrite(str(output / name), photo, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        labels.append({"image": name, "card_box": box, **label})
+
+    labels_path = output / "labels.json"
+    with open(labels_path, "w") as file:
+        json.dump(labels, file, indent=2)
+    return str(labels_path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--output", default="../../data/benchmark")
+    parser.add_argument("--size", type=int, nargs=2, default=[1920, 1440], help="width and height of the photos")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"Labels written to {generate(count=args.count, output=args.output, photo_size=tuple(args.size), seed=args.seed)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
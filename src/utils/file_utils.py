@@ -1,8 +1,13 @@
 from fastapi import UploadFile, HTTPException
 from PIL import Image
+from src.config.config import Config
+from typing import List, Tuple
 import numpy as np
 import cv2
 import io
+import zipfile
+
+config = Config()
 
 def crop_image(img: np.ndarray, bbox: tuple) -> np.ndarray:
     """This methods crops an image according to its
@@ -84,8 +89,8 @@ def preprocess_img(image: np.ndarray, save: bool = False) -> np.ndarray:
     if image is None:
         raise FileNotFoundError("Imagen no valida")
     
-    # Convert img to gray scale
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    # Convert img to gray scale, the images of the service are in BGR order
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
     if save:
         cv2.imwrite("./gray.jpg", gray)
     # Increase constrast and brightness
@@ -99,15 +104,143 @@ def preprocess_img(image: np.ndarray, save: bool = False) -> np.ndarray:
         cv2.imwrite("./enhanced.jpg", enhanced)
     return enhanced
 
-def validate_image(file: UploadFile):
+class ImageTooLargeError(ValueError):
+    """The image is over the MAX_IMAGE_BYTES or MAX_IMAGE_PIXELS limits"""
+
+# Flag of cv2.imdecode for each downsampling factor, the JPEG decoder scales
+# the image while it decodes it (like the PIL draft mode)
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def decode_image(data: bytes, max_pixels: int = None, max_side: int = None) -> np.ndarray:
+    """Decode an image file to a contiguous uint8 array in BGR order, the color
+    order of every model of the service. Gray images are expanded to 3 channels
+    and the alpha channel is dropped.
+
+    The size of the image is read from its header before decoding it, so an
+    oversized image is rejected without allocating its pixels. When the image
+    is much larger than max_side it is downsampled while it is decoded, by the
+    largest factor (2, 4 or 8) that keeps its longest side over max_side.
+
+    Args:
+        data (bytes): content of the image file
+        max_pixels (int, optional): max width * height. Default value is MAX_IMAGE_PIXELS
+        max_side (int, optional): target of the downsampling, 0 disables it.
+    Default value is DECODE_MAX_SIDE
+
+    Raises:
+        ImageTooLargeError: if the image has more than max_pixels
+        ValueError: if the bytes are not a valid image
+
+    Returns:
+        np.ndarray: the decoded image with shape (h, w, 3)
+    """
+    max_pixels = config.MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    max_side = config.DECODE_MAX_SIDE if max_side is None else max_side
+    try:
+        # PIL only parses the header here, the pixels are not decoded
+        with Image.open(io.BytesIO(data)) as header:
+            width, height = header.size
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    except Exception as e:
+        raise ValueError("File not valid!") from e
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"Image too large: {width}x{height} pixels")
+
+    factor = 1
+    if max_side:
+        while factor < 8 and max(width, height) // (factor * 2) >= max_side:
+            factor *= 2
+    # View over the bytes without copying them
+    buffer = np.frombuffer(memoryview(data), dtype=np.uint8)
+    image = cv2.imdecode(buffer, REDUCED_FLAGS[factor])
+    if image is None:
+        raise ValueError("File not valid!")
+    return image
+
+def validate_image(file: UploadFile) -> np.ndarray:
+    """Decode the image uploaded in a request with decode_image
+
+    Args:
+        file (UploadFile): file uploaded in the request
+
+    Raises:
+        HTTPException: 413 if the file or the image is too large, 400 if it is
+    not a valid image
+
+    Returns:
+        np.ndarray: the decoded image in BGR order
+    """
+    if file.size is not None and file.size > config.MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413,
+                            detail="File too large!")
     try:
-        # Try to open file as an image
-        image = Image.open(io.BytesIO(file.file.read()))
-        return image
-    except Exception:
+        return decode_image(data=file.file.read())
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413,
+                            detail=str(e))
+    except ValueError:
         raise HTTPException(status_code=400,
                             detail="File not valid!")
-        
-def image_to_numpy(image: Image.Image) -> np.ndarray:
-    return np.array(image)
-    
\ No newline at end of file
+
+def read_batch_files(files: List[UploadFile]) -> List[Tuple[str, bytes, str]]:
+    """Read the files of a batch request. The zip files are expanded, so
+    each image inside a zip is a new item of the batch
+
+    The sizes are checked before reading: a file or zip member over
+    MAX_IMAGE_BYTES is not read and its item carries the error. The zip
+    members are checked by their uncompressed size, and zipfile never reads
+    more than that size, so a zip bomb can't exhaust the memory.
+
+    Args:
+        files (List[UploadFile]): files uploaded in the request
+
+    Raises:
+        HTTPException: 400 if a zip file is not valid, 413 if the batch has more
+    than MAX_BATCH_FILES images or more than MAX_BATCH_BYTES
+
+    Returns:
+        List[Tuple[str, bytes, str]]: name, content and error of each image file. The
+    content is None when the file was not read because of the error
+    """
+    items = []
+    total = 0
+
+    def add(name: str, size: int, read) -> None:
+        nonlocal total
+        if len(items) >= config.MAX_BATCH_FILES:
+            raise HTTPException(status_code=413,
+                                detail=f"Too many files, the limit is {config.MAX_BATCH_FILES}")
+        data = None
+        if size is None:
+            # The size of the upload is unknown until it is read
+            data = read()
+            size = len(data)
+        if size > config.MAX_IMAGE_BYTES:
+            items.append((name, None, "File too large!"))
+            return
+        total += size
+        if total > config.MAX_BATCH_BYTES:
+            raise HTTPException(status_code=413,
+                                detail="Batch too large!")
+        items.append((name, data if data is not None else read(), None))
+
+    for file in files:
+        if file.filename and file.filename.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(file.file) as zf:
+                    for info in zf.infolist():
+                        if not info.is_dir():
+                            add(info.filename, info.file_size, lambda info=info: zf.read(info))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400,
+                                    detail=f"Zip file not valid: {file.filename}")
+        else:
+            # Never more than one byte over the limit is read
+            add(file.filename, file.size, lambda file=file: file.file.read(config.MAX_IMAGE_BYTES + 1))
+    return items
@@ -0,0 +1,176 @@
+from logging.handlers import QueueHandler, QueueListener
+from src.config.config import Config
+from datetime import datetime, timezone
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+
+config = Config()
+
+ROOT_LOGGER = "src"
+
+# 13 to 19 digits, optionally grouped with spaces or dashes, like the card numbers
+# printed on the cards and the outputs of the OCR. They are masked even when they
+# fail the Luhn check, the OCR often misreads a digit of a real card number
+PAN_PATTERN = re.compile(r"(?<!\d)(?:\d[ -]?){12,18}\d(?!\d)")
+
+_listener = None
+_lock = threading.Lock()
+
+
+def mask_pan(text: str) -> str:
+    """Mask the card numbers of a text, only the first 6 and the last 4 digits
+    are kept (the digits allowed by PCI DSS)
+
+    Args:
+        text (str): text that may contain card numbers
+
+    Returns:
+        str: the text with the middle digits of each card number replaced by *
+    """
+    def mask(match: re.Match) -> str:
+        digits = re.sub(r"\D", "", match.group())
+        return digits[:6] + "*" * (len(digits) - 10) + digits[-4:]
+
+    return PAN_PATTERN.sub(mask, text)
+
+
+def mask_card_number(card_number: str) -> str:
+    """Mask a card number field before it is logged. Unlike mask_pan it doesn't
+    need a run of 13 digits, the OCR can drop digits or read letters, so only the
+    last 4 characters are kept, and the first 6 too when it has the length of a PAN
+
+    Args:
+        card_number (str): card number read by the OCR, it may be None
+
+    Returns:
+        str: the card number with the other characters replaced by *
+    """
+    if not card_number:
+        return card_number
+    keep = 6 if len(card_number) >= 13 else 0
+    if len(card_number) <= keep + 4:
+        return "*" * len(card_number)
+    return card_number[:keep] + "*" * (len(card_number) - keep - 4) + card_number[-4:]
+
+
+class MaskingQueueHandler(QueueHandler):
+    """QueueHandler that renders the message in the caller thread, masking the
+    card numbers, and leaves the formatting and the I/O to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = mask_pan(record.getMessage())
+        exc_text = None
+        if record.exc_info:
+            exc_text = mask_pan(logging.Formatter().formatException(record.exc_info))
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        # The traceback objects can't cross the queue, the formatters use exc_text
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Let through only a fraction of the DEBUG records, the hot paths of the
+    pipelines log at DEBUG on every request"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the extra fields of the record"""
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        # The extra fields are not part of the message masked by MaskingQueueHandler
+        data.update({key: mask_pan(value) if isinstance(value, str) else value
+                     for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+def setup_logging() -> None:
+    """Configure the loggers of the service, only the first call has effect
+
+    The records of the loggers under "src" are masked and put in a queue by
+    the thread that logs them, a listener thread formats them (LOG_FORMAT
+    "json" or "text") and writes them to stderr. Below LOG_LEVEL a log call
+    only costs a level check.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler()
+        if config.LOG_FORMAT == "json":
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s"))
+
+        handler = MaskingQueueHandler(queue.SimpleQueue())
+        handler.addFilter(DebugSamplingFilter(rate=config.LOG_DEBUG_SAMPLE_RATE))
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(config.LOG_LEVEL)
+        logger.addHandler(handler)
+        # The records are written by the listener, not by the handlers of the root logger
+        logger.propagate = False
+
+        _listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        # Flush the queue when the process exits
+        atexit.register(_stop_listener)
+        # The listener thread is not copied by fork, the forked workers start their own
+        os.register_at_fork(after_in_child=_restart_listener)
+
+
+def _stop_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_listener() -> None:
+    global _listener
+    handler = next(h for h in logging.getLogger(ROOT_LOGGER).handlers if isinstance(h, MaskingQueueHandler))
+    # A new queue, the lock of the old one could be held by the thread of the parent
+    handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger of a module of the service
+
+    Args:
+        name (str): name of the module (__name__), the scripts (__main__) log under "src"
+
+    Returns:
+        logging.Logger: logger under the "src" logger, configured by setup_logging
+    """
+    setup_logging()
+    if name != ROOT_LOGGER and not name.startswith(f"{ROOT_LOGGER}."):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)